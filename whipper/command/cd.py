@@ -20,12 +20,15 @@
 
 import argparse
 import cdio
+import multiprocessing
 import os
 import glob
 import logging
+import sys
+import time
 from whipper.command.basecommand import BaseCommand
 from whipper.common import (
-    accurip, config, drive, program, task
+    accurip, common, config, drive, encode, program, staging, task
 )
 from whipper.common.common import validate_template
 from whipper.program import cdrdao, cdparanoia, utils
@@ -63,6 +66,19 @@ disc and track template are:
 '''
 
 
+def _getReadOffset(device):
+    """
+    Return the configured read offset of the given drive, or None.
+    """
+    info = drive.getDeviceInfo(device)
+    if not info:
+        return None
+    try:
+        return config.Config().getReadOffset(*info)
+    except KeyError:
+        return None
+
+
 class _CD(BaseCommand):
     eject = True
 
@@ -95,7 +111,8 @@ class _CD(BaseCommand):
 
         # first, read the normal TOC, which is fast
         logger.info("reading TOC...")
-        self.ittoc = self.program.getFastToc(self.runner, self.device)
+        with self.program.metrics.phase('toc'):
+            self.ittoc = self.program.getFastToc(self.runner, self.device)
 
         # already show us some info based on this
         self.program.getRipResult(self.ittoc.getCDDBDiscId())
@@ -106,17 +123,19 @@ class _CD(BaseCommand):
         print("MusicBrainz lookup URL %s" %
               self.ittoc.getMusicBrainzSubmitURL())
 
-        self.program.metadata = (
-            self.program.getMusicBrainz(self.ittoc, self.mbdiscid,
-                                        release=self.options.release_id,
-                                        country=self.options.country,
-                                        prompt=self.options.prompt)
-        )
+        with self.program.metrics.phase('metadata'):
+            self.program.metadata = (
+                self.program.getMusicBrainz(self.ittoc, self.mbdiscid,
+                                            release=self.options.release_id,
+                                            country=self.options.country,
+                                            prompt=self.options.prompt)
+            )
 
         if not self.program.metadata:
             # fall back to FreeDB for lookup
             cddbid = self.ittoc.getCDDBValues()
-            cddbmd = self.program.getCDDB(cddbid)
+            with self.program.metrics.phase('metadata'):
+                cddbmd = self.program.getCDDB(cddbid)
             if cddbmd:
                 logger.info('FreeDB identifies disc as %s', cddbmd)
 
@@ -143,11 +162,11 @@ class _CD(BaseCommand):
                                          self.mbdiscid,
                                          self.program.metadata)
         # now, read the complete index table, which is slower
-        self.itable = self.program.getTable(self.runner,
-                                            self.ittoc.getCDDBDiscId(),
-                                            self.ittoc.getMusicBrainzDiscId(),
-                                            self.device, self.options.offset,
-                                            out_fpath)
+        with self.program.metrics.phase('table'):
+            self.itable = self.program.getTable(
+                self.runner, self.ittoc.getCDDBDiscId(),
+                self.ittoc.getMusicBrainzDiscId(), self.device,
+                self.options.offset, out_fpath)
 
         assert self.itable.getCDDBDiscId() == self.ittoc.getCDDBDiscId(), \
             "full table's id %s differs from toc id %s" % (
@@ -229,14 +248,6 @@ Log files will log the path to tracks relative to this directory.
 
     def add_arguments(self):
         loggers = list(result.getLoggers())
-        default_offset = None
-        info = drive.getDeviceInfo(self.opts.device)
-        if info:
-            try:
-                default_offset = config.Config().getReadOffset(*info)
-                logger.info("using configured read offset %d", default_offset)
-            except KeyError:
-                pass
 
         _CD.add_arguments(self.parser)
 
@@ -245,11 +256,11 @@ Log files will log the path to tracks relative to this directory.
                                  default='whipper',
                                  help=("logger to use (choose from: '%s" %
                                        "', '".join(loggers) + "')"))
-        # FIXME: get from config
         self.parser.add_argument('-o', '--offset',
                                  action="store", dest="offset",
-                                 default=default_offset,
-                                 help="sample read offset")
+                                 help="sample read offset; defaults to "
+                                 "the configured read offset of the "
+                                 "drive")
         self.parser.add_argument('-x', '--force-overread',
                                  action="store_true", dest="overread",
                                  default=False,
@@ -286,6 +297,74 @@ Log files will log the path to tracks relative to this directory.
                                  help="whether to continue ripping if "
                                  "the disc is a CD-R",
                                  default=False)
+        self.parser.add_argument('--whole-disc',
+                                 action="store_true", dest="whole_disc",
+                                 help="read all tracks in one continuous "
+                                 "test and copy read, instead of reading "
+                                 "every track twice by itself",
+                                 default=False)
+        self.parser.add_argument('--stream',
+                                 action="store_true", dest="stream",
+                                 help="encode tracks while they are read, "
+                                 "without storing them uncompressed",
+                                 default=False)
+        self.parser.add_argument('--pipeline',
+                                 action="store_true", dest="pipeline",
+                                 help="encode and tag tracks in the "
+                                 "background while the next track is read",
+                                 default=False)
+        self.parser.add_argument('--staging-directory',
+                                 action="store", dest="staging_directory",
+                                 help="directory to store ripped audio in "
+                                 "until it is encoded, such as a tmpfs "
+                                 "like /dev/shm; defaults to the "
+                                 "temporary directory")
+        self.parser.add_argument('--staging-budget',
+                                 action="store", type=int,
+                                 dest="staging_budget",
+                                 help="MiB of ripped audio the staging "
+                                 "directory, or else the temporary "
+                                 "directory, can hold at once; more waits "
+                                 "for tracks being encoded, or goes to "
+                                 "the temporary directory")
+        self.parser.add_argument('--devices',
+                                 action="store", dest="devices",
+                                 help="comma-separated CD-DA devices to rip "
+                                 "the discs of at once, in one process "
+                                 "per drive; each drive uses its "
+                                 "configured read offset, or --offset")
+        self.parser.add_argument('--paranoia',
+                                 action="store", dest="paranoia",
+                                 choices=cdparanoia.PARANOIA_LEVELS +
+                                 ('adaptive', ),
+                                 help="paranoia level to read with; "
+                                 "adaptive reads without paranoia first "
+                                 "and escalates to full paranoia for "
+                                 "tracks that do not verify "
+                                 "(default %(default)s)",
+                                 default='full')
+        self.parser.add_argument('--accuraterip-first',
+                                 action="store_true",
+                                 dest="accuraterip_first",
+                                 help="skip the test read of tracks whose "
+                                 "copy read matches the AccurateRip "
+                                 "database with enough confidence",
+                                 default=False)
+        self.parser.add_argument('--accuraterip-confidence',
+                                 action="store", type=int,
+                                 dest="accuraterip_confidence",
+                                 help="confidence an AccurateRip checksum "
+                                 "needs to skip the test read "
+                                 "(default %(default)s)",
+                                 default=2)
+        self.parser.add_argument('--metrics-textfile',
+                                 action="store", dest="metrics_textfile",
+                                 help="also write the metrics of the rip, "
+                                 "which are stored as .metrics.json next "
+                                 "to the log, to this file in the "
+                                 "Prometheus text format; with --devices, "
+                                 "the name of each device is added before "
+                                 "the extension")
 
     def handle_arguments(self):
         self.options.output_directory = os.path.expanduser(
@@ -297,18 +376,41 @@ Log files will log the path to tracks relative to this directory.
         self.options.disc_template = self.options.disc_template.decode('utf-8')
         validate_template(self.options.disc_template, 'disc')
 
-        if self.options.offset is None:
-            raise ValueError("Drive offset is unconfigured.\n"
-                             "Please install pycdio and run 'whipper offset "
-                             "find' to detect your drive's offset or set it "
-                             "manually in the configuration file. It can "
-                             "also be specified at runtime using the "
-                             "'--offset=value' argument")
+        if self.options.devices:
+            self.options.devices = [os.path.realpath(d) for d in
+                                    self.options.devices.split(',')]
+            for d in self.options.devices:
+                if not os.path.exists(d):
+                    raise IOError('CD-DA device %s not found!' % d)
+            if self.options.prompt:
+                raise ValueError("--prompt can not be used with --devices")
+        else:
+            if self.options.offset is None:
+                self.options.offset = _getReadOffset(self.options.device)
+                if self.options.offset is not None:
+                    logger.info("using configured read offset %d",
+                                self.options.offset)
+            if self.options.offset is None:
+                raise ValueError("Drive offset is unconfigured.\n"
+                                 "Please install pycdio and run 'whipper "
+                                 "offset find' to detect your drive's "
+                                 "offset or set it manually in the "
+                                 "configuration file. It can also be "
+                                 "specified at runtime using the "
+                                 "'--offset=value' argument")
 
         if self.options.working_directory is not None:
             self.options.working_directory = os.path.expanduser(
                 self.options.working_directory)
 
+        if self.options.staging_directory is not None:
+            self.options.staging_directory = os.path.expanduser(
+                self.options.staging_directory)
+
+        if self.options.metrics_textfile is not None:
+            self.options.metrics_textfile = os.path.abspath(
+                os.path.expanduser(self.options.metrics_textfile))
+
         if self.options.logger:
             try:
                 self.logger = result.getLoggers()[self.options.logger]()
@@ -317,6 +419,51 @@ Log files will log the path to tracks relative to this directory.
                 logger.critical(msg)
                 raise ValueError(msg)
 
+    def do(self):
+        if not self.options.devices:
+            return _CD.do(self)
+
+        self._limitEncoders()
+        processes = []
+        for device in self.options.devices:
+            logger.info('ripping disc in %s', device)
+            processes.append(self._forkRip(device))
+
+        failed = []
+        for p in processes:
+            p.join()
+            if p.exitcode:
+                failed.append(p.name)
+        if failed:
+            raise RuntimeError("ripping failed for %s" % ", ".join(failed))
+
+    def _limitEncoders(self):
+        # the drives only share the machine's CPUs for encoding
+        encode.limitEncoders(multiprocessing.BoundedSemaphore(
+            common.getCPUCount()))
+
+    def _forkRip(self, device):
+        p = multiprocessing.Process(target=self._ripDevice,
+                                    args=(device, ), name=device)
+        p.start()
+        return p
+
+    def _ripDevice(self, device):
+        # runs in a process of its own for every drive; without --offset
+        # each drive rips with its own configured read offset
+        self.options.device = device
+        if self.options.offset is None:
+            self.options.offset = _getReadOffset(device)
+        try:
+            if self.options.offset is None:
+                raise ValueError("drive offset of %s is unconfigured" %
+                                 device)
+            ret = _CD.do(self)
+        except Exception as e:
+            logger.critical('ripping disc in %s failed: %s', device, e)
+            ret = 1
+        sys.exit(ret or 0)
+
     def doCommand(self):
         self.program.setWorkingDirectory(self.options.working_directory)
         self.program.outdir = self.options.output_directory.decode('utf-8')
@@ -324,6 +471,11 @@ Log files will log the path to tracks relative to this directory.
         self.program.result.overread = self.options.overread
         self.program.result.logger = self.options.logger
 
+        budget = self.options.staging_budget
+        if budget is not None:
+            budget *= 1024 * 1024
+        staging.configure(self.options.staging_directory, budget)
+
         discName = self.program.getPath(self.program.outdir,
                                         self.options.disc_template,
                                         self.mbdiscid,
@@ -341,6 +493,24 @@ Log files will log the path to tracks relative to this directory.
                         dirname.encode('utf-8'))
             os.makedirs(dirname)
 
+        # with pipelining, the drive only reads and verifies; encoding and
+        # tagging happen on this pool while it reads the next track
+        encoder = None
+        if self.options.pipeline:
+            encoder = encode.EncodePool()
+
+        # fetch AccurateRip checksums up front, so tracks that match them
+        # only need to be read once
+        responses = None
+        if self.options.accuraterip_first:
+            try:
+                with self.program.metrics.phase('accuraterip'):
+                    responses = accurip.get_db_entry(
+                        self.ittoc.accuraterip_path())
+            except accurip.EntryNotFound:
+                logger.warning('AccurateRip entry not found, doing test '
+                               'reads')
+
         # FIXME: turn this into a method
 
         def _ripIfNotRipped(number):
@@ -388,6 +558,11 @@ Log files will log the path to tracks relative to this directory.
 
             if not os.path.exists(path):
                 logger.debug('path %r does not exist, ripping...', path)
+                accuraterip = None
+                if responses:
+                    accuraterip = accurip.get_confident_checksums(
+                        responses, number,
+                        self.options.accuraterip_confidence)
                 tries = 0
                 # we reset durations for test and copy here
                 trackResult.testduration = 0.0
@@ -397,6 +572,11 @@ Log files will log the path to tracks relative to this directory.
                     tries += 1
                     if tries > 1:
                         extra = " (try %d)" % tries
+                    paranoia = self.options.paranoia
+                    if paranoia == 'adaptive':
+                        paranoia = cdparanoia.adaptiveParanoia(tries - 1)
+                        logger.info('reading track %d with paranoia %s',
+                                    number, paranoia)
                     logger.info('ripping track %d of %d%s: %s',
                                 number, len(self.itable.tracks), extra,
                                 os.path.basename(path).encode('utf-8'))
@@ -412,19 +592,31 @@ Log files will log the path to tracks relative to this directory.
                                               what='track %d of %d%s' % (
                                                   number,
                                                   len(self.itable.tracks),
-                                                  extra))
+                                                  extra),
+                                              # HTOA may get discarded below
+                                              encoder=(encoder if number
+                                                       else None),
+                                              stream=self.options.stream,
+                                              accuraterip=accuraterip,
+                                              paranoia=paranoia)
                         break
                     except Exception as e:
                         logger.debug('got exception %r on try %d', e, tries)
 
+                self.program.metrics.addTrack(number, tries=tries)
                 if tries == MAX_TRIES:
                     logger.critical('giving up on track %d after %d times',
                                     number, tries)
                     raise RuntimeError(
                         "track can't be ripped. "
                         "Rip attempts number is equal to 'MAX_TRIES'")
-                if trackResult.testcrc == trackResult.copycrc:
+                if trackResult.testcrc is None:
+                    logger.info('track %d matches AccurateRip, test read '
+                                'skipped', number)
+                elif trackResult.testcrc == trackResult.copycrc:
                     logger.info('CRCs match for track %d', number)
+                elif trackResult.rereads:
+                    logger.info('copy read of track %d repaired', number)
                 else:
                     raise RuntimeError(
                         "CRCs did not match for track %d" % number
@@ -457,21 +649,47 @@ Log files will log the path to tracks relative to this directory.
 
         # check for hidden track one audio
         htoa = self.program.getHTOA()
-        if htoa:
-            start, stop = htoa
-            logger.info('found Hidden Track One Audio from frame %d to %d',
-                        start, stop)
-            _ripIfNotRipped(0)
-
-        for i, track in enumerate(self.itable.tracks):
-            # FIXME: rip data tracks differently
-            if not track.audio:
-                logger.warning('skipping data track %d, not implemented',
-                               i + 1)
-                # FIXME: make it work for now
-                track.indexes[1].relative = 0
-                continue
-            _ripIfNotRipped(i + 1)
+        if self.options.whole_disc:
+            self._ripDisc(htoa)
+
+        try:
+            if htoa:
+                start, stop = htoa
+                logger.info('found Hidden Track One Audio from frame %d to '
+                            '%d', start, stop)
+                _ripIfNotRipped(0)
+
+            for i, track in enumerate(self.itable.tracks):
+                # FIXME: rip data tracks differently
+                if not track.audio:
+                    logger.warning('skipping data track %d, not implemented',
+                                   i + 1)
+                    # FIXME: make it work for now
+                    track.indexes[1].relative = 0
+                    continue
+                _ripIfNotRipped(i + 1)
+
+            if encoder:
+                logger.info('waiting for tracks to be encoded')
+                failed = encoder.join()
+                for trackResult in self.program.result.tracks:
+                    if trackResult.filename in encoder.durations:
+                        self.program.metrics.addTrack(
+                            trackResult.number, encode_seconds=(
+                                encoder.durations[trackResult.filename]))
+                for path, e in failed:
+                    logger.critical('encoding %s failed: %r',
+                                    os.path.basename(path).encode('utf-8'),
+                                    e)
+                if failed:
+                    raise RuntimeError("%d track(s) could not be encoded" %
+                                       len(failed))
+        finally:
+            # tracks of the disc read may still be encoded from it when
+            # ripping failed
+            if encoder:
+                encoder.join()
+            self.program.removeDisc()
 
         logger.debug('writing cue file for %r', discName)
         self.program.writeCue(discName)
@@ -490,6 +708,105 @@ Log files will log the path to tracks relative to this directory.
 
         self.program.writeLog(discName, self.logger)
 
+        textfile = self.options.metrics_textfile
+        if textfile and self.options.devices:
+            root, ext = os.path.splitext(textfile)
+            textfile = '%s.%s%s' % (root, os.path.basename(self.device), ext)
+        self.program.writeMetrics(discName, self.device, textfile)
+
+    def _ripDisc(self, htoa):
+        # read all audio in one test and one copy read; ripTrack encodes
+        # the tracks from it, and reads the ones that did not verify again
+        if self.program.result.tracks:
+            logger.info('resuming a previous rip, reading track by track')
+            return
+        if self.itable.hasDataTracks():
+            logger.warning('disc has data tracks, reading track by track')
+            return
+
+        numbers = [t.number for t in self.itable.tracks]
+        if htoa:
+            numbers.insert(0, 0)
+        # with adaptive paranoia, tracks that do not verify are read again
+        # with more paranoia track by track
+        paranoia = self.options.paranoia
+        if paranoia == 'adaptive':
+            paranoia = cdparanoia.adaptiveParanoia(0)
+        logger.info('reading the whole disc with paranoia %s', paranoia)
+        try:
+            self.program.ripDisc(self.runner, numbers,
+                                 offset=int(self.options.offset),
+                                 device=self.device,
+                                 overread=self.options.overread,
+                                 paranoia=paranoia)
+        except Exception as e:
+            logger.warning('reading the whole disc failed, reading track '
+                           'by track: %r', e)
+
+
+class Daemon(Rip):
+    summary = "rip discs as they are inserted"
+    description = """
+Waits for discs to be inserted in the drives, and rips them as the rip
+command would, ejecting each disc when it is done.
+
+Give the drives to watch with --devices; by default, the drive given to the
+cd command is watched.  The rip options apply to every disc.
+"""
+    formatter_class = argparse.RawTextHelpFormatter
+
+    def add_arguments(self):
+        Rip.add_arguments(self)
+
+        self.parser.add_argument('--interval',
+                                 action="store", type=float,
+                                 dest="interval",
+                                 help="seconds between checks of the "
+                                 "drives for a disc (default %(default)s)",
+                                 default=2.0)
+
+    def handle_arguments(self):
+        Rip.handle_arguments(self)
+
+        if self.options.prompt:
+            raise ValueError("--prompt can not be used with cd daemon")
+
+    def do(self):
+        devices = self.options.devices or [self.options.device]
+        self._limitEncoders()
+        # every rip runs in a child process; look up the versions of the
+        # tools once here, so the rips inherit them
+        cdrdao.getCDRDAOVersion()
+        cdparanoia.getCdParanoiaVersion()
+
+        rips = {}  # device -> process ripping its disc
+        ripped = set()  # devices still holding a disc that was ripped
+        logger.info('waiting for discs in %s', ', '.join(devices))
+        while True:
+            for device in devices:
+                p = rips.get(device)
+                if p:
+                    if p.is_alive():
+                        continue
+                    p.join()
+                    del rips[device]
+                    ripped.add(device)
+                    if p.exitcode:
+                        logger.warning('ripping disc in %s failed', device)
+                        if self.options.eject in ('failure', 'always'):
+                            utils.eject_device(device)
+                    else:
+                        logger.info('ripped disc in %s', device)
+                    continue
+
+                if utils.get_drive_status(device) != utils.CDS_DISC_OK:
+                    ripped.discard(device)
+                elif device not in ripped:
+                    logger.info('disc inserted in %s, ripping', device)
+                    rips[device] = self._forkRip(device)
+
+            time.sleep(self.options.interval)
+
 
 class CD(BaseCommand):
     summary = "handle CDs"
@@ -497,6 +814,7 @@ class CD(BaseCommand):
     device_option = True
 
     subcommands = {
+        'daemon': Daemon,
         'info': Info,
         'rip': Rip
     }
@@ -39,6 +39,10 @@ Verifies the image from the given .cue files against the AccurateRip database.
     def add_arguments(self):
         self.parser.add_argument('cuefile', nargs='+', action='store',
                                  help="cue file to load rip image from")
+        self.parser.add_argument('-w', '--workers', action='store',
+                                 type=int, dest='workers',
+                                 help="number of tracks to checksum "
+                                 "concurrently (default: number of CPUs)")
 
     def do(self):
         prog = program.Program(config.Config())
@@ -47,7 +51,7 @@ Verifies the image from the given .cue files against the AccurateRip database.
         for arg in self.options.cuefile:
             arg = arg.decode('utf-8')
             cueImage = image.Image(arg)
-            cueImage.setup(runner)
+            cueImage.setup(runner, workers=self.options.workers)
 
             # FIXME: this feels like we're poking at internals.
             prog.cuePath = arg
@@ -59,7 +63,8 @@ Verifies the image from the given .cue files against the AccurateRip database.
 
             verified = False
             try:
-                verified = prog.verifyImage(runner, cueImage.table)
+                verified = prog.verifyImage(runner, cueImage.table,
+                                            workers=self.options.workers)
             except accurip.EntryNotFound:
                 print('AccurateRip entry not found')
             accurip.print_report(prog.result)
@@ -23,9 +23,9 @@ import os
 import tempfile
 import logging
 from whipper.command.basecommand import BaseCommand
-from whipper.common import accurip, common, config, drive
+from whipper.common import accurip, checksum, common, config, drive
 from whipper.common import task as ctask
-from whipper.program import arc, cdrdao, cdparanoia, utils
+from whipper.program import cdrdao, cdparanoia, utils
 from whipper.extern.task import task
 
 logger = logging.getLogger(__name__)
@@ -49,7 +49,10 @@ OFFSETS = ("+6, +667, +48, +102, +12, +30, +103, +618, +96, +594, "
 class Find(BaseCommand):
     summary = "find drive read offset"
     description = """Find drive's read offset by ripping tracks from a
-CD in the AccurateRip database."""
+CD in the AccurateRip database.
+
+Each track is ripped only once; the checksums for all offsets are
+calculated from that single read."""
     formatter_class = argparse.ArgumentDefaultsHelpFormatter
     device_option = True
 
@@ -102,56 +105,46 @@ CD in the AccurateRip database."""
                 logger.warning("AccurateRip response discid different: %s",
                                responses[0].cddbDiscId)
 
-        # now rip the first track at various offsets, calculating AccurateRip
-        # CRC, and matching it against the retrieved ones
+        # now rip the first track once, with enough samples around it to
+        # cover every offset, calculate its AccurateRip checksums for all
+        # offsets from that, and match them against the retrieved ones
 
         # archecksums is a tuple of accuraterip checksums: (v1, v2)
         def match(archecksums, track, responses):
             for i, r in enumerate(responses):
-                for checksum in archecksums:
-                    if checksum == r.checksums[track - 1]:
-                        return checksum, i
+                for archecksum in archecksums:
+                    if archecksum == r.checksums[track - 1]:
+                        return archecksum, i
 
             return None, None
 
-        for offset in self._offsets:
-            logger.info('trying read offset %d...', offset)
+        # track -> (path, lead) of the tracks ripped with extra samples
+        self._windows = {}
+        try:
             try:
-                archecksums = self._arcs(runner, table, 1, offset)
+                offsets = self._candidates(runner, table, responses, match)
             except task.TaskException as e:
-
                 # let MissingDependency fall through
                 if isinstance(e.exception, common.MissingDependencyException):
                     raise e
 
-                if isinstance(e.exception, cdparanoia.FileSizeError):
-                    logger.warning('cannot rip with offset %d...', offset)
-                    continue
+                logger.warning('cannot rip track 1: %s', e)
+                offsets = []
 
-                logger.warning("unknown task exception for offset %d: %s",
-                               offset, e)
-                logger.warning('cannot rip with offset %d...', offset)
-                continue
-
-            logger.debug('AR checksums calculated: %s %s', archecksums)
-
-            c, i = match(archecksums, 1, responses)
-            if c:
+            for offset in offsets:
                 count = 1
-                logger.debug('matched against response %d', i)
                 logger.info('offset of device is likely %d, confirming...',
                             offset)
 
-                # now try and rip all other tracks as well, except for the
+                # now try all other tracks as well, except for the
                 # last one (to avoid readers that can't do overread
                 for track in range(2, (len(table.tracks) + 1) - 1):
                     try:
                         archecksums = self._arcs(runner, table, track, offset)
-                    except task.TaskException as e:
-                        if isinstance(e.exception, cdparanoia.FileSizeError):
-                            logger.warning('cannot rip with offset %d...',
-                                           offset)
-                            continue
+                    except (task.TaskException, common.MissingFrames) as e:
+                        logger.warning('cannot check track %d with offset '
+                                       '%d: %s', track, offset, e)
+                        continue
 
                     c, i = match(archecksums, track, responses)
                     if c:
@@ -166,36 +159,90 @@ CD in the AccurateRip database."""
                     logger.warning('only %d of %d tracks matched, '
                                    'continuing...', count,
                                    len(table.tracks))
+        finally:
+            for path, _ in self._windows.values():
+                os.unlink(path)
 
         logger.error('no matching offset found. '
                      'Consider trying again with a different disc')
 
-    def _arcs(self, runner, table, track, offset):
-        # rips the track with the given offset, return the arcs checksums
-        logger.debug('ripping track %r with offset %d...', track, offset)
+    def _window(self, runner, table, track):
+        """
+        Rip the track once, with enough samples before and after it to
+        calculate its checksums at all offsets.
+
+        @returns: path to the ripped .wav file, number of samples before
+                  the track start in it
+        """
+        if track in self._windows:
+            return self._windows[track]
+
+        # read the track shifted back by the margin, so the window starts
+        # margin frames before the track even on the first track
+        margin = max([abs(o) for o in self._offsets])
+        margin = margin / common.SAMPLES_PER_FRAME + 1
+        start = table.getTrackStart(track)
+        stop = min(table.getTrackEnd(track) + 2 * margin, table.leadout - 1)
+        lead = margin * common.SAMPLES_PER_FRAME
+        logger.debug('ripping track %r from frame %d to %d...',
+                     track, start - margin, stop - margin)
 
         fd, path = tempfile.mkstemp(
-            suffix=u'.track%02d.offset%d.whipper.wav' % (
-                track, offset))
+            suffix=u'.track%02d.whipper.wav' % track)
         os.close(fd)
+        try:
+            t = cdparanoia.ReadTrackTask(path, table, start, stop,
+                                         overread=False, offset=-lead,
+                                         device=self.options.device)
+            t.description = 'Ripping track %d' % track
+            runner.run(t)
+        except task.TaskException:
+            os.unlink(path)
+            raise
+
+        self._windows[track] = (path, lead)
+        return path, lead
+
+    def _candidates(self, runner, table, responses, match):
+        """
+        Rip the first track and return an iterator over the offsets at
+        which it matches AccurateRip, in the order they were given.
+        """
+        path, lead = self._window(runner, table, 1)
+        length = table.getTrackLength(1) * common.SAMPLES_PER_FRAME
+        data = ''.join(checksum._read_wave(path))
+
+        logger.info('calculating AccurateRip checksums for %d offsets...',
+                    len(self._offsets))
+        arcs = checksum.AccurateRipOffsetChecksums(data, lead, length, 1,
+                                                   len(table.tracks))
+        v1s = arcs.v1(self._offsets)
+
+        def candidates():
+            for offset in self._offsets:
+                if offset not in v1s:
+                    continue
+                logger.debug('trying read offset %d...', offset)
+                if match(("%08x" % v1s[offset], ), 1, responses)[0]:
+                    yield offset
+                # v2 checksums can't be slid, so only calculate them
+                # for the offsets we actually get to
+                elif match(("%08x" % arcs.checksums(offset)[1], ), 1,
+                           responses)[0]:
+                    yield offset
+
+        return candidates()
+
+    def _arcs(self, runner, table, track, offset):
+        # return the arcs checksums of the track read at the given offset
+        path, lead = self._window(runner, table, track)
+        length = table.getTrackLength(track) * common.SAMPLES_PER_FRAME
+
+        arc = checksum.AccurateRipChecksum(track, len(table.tracks))
+        for data in checksum._read_wave(path, lead + offset, length):
+            arc.update(data)
+        v1, v2 = arc.finish()
 
-        t = cdparanoia.ReadTrackTask(path, table,
-                                     table.getTrackStart(
-                                         track), table.getTrackEnd(track),
-                                     overread=False, offset=offset,
-                                     device=self.options.device)
-        t.description = 'Ripping track %d with read offset %d' % (
-            track, offset)
-        runner.run(t)
-
-        v1 = arc.accuraterip_checksum(
-                path, track, len(table.tracks), wave=True, v2=False
-            )
-        v2 = arc.accuraterip_checksum(
-                path, track, len(table.tracks), wave=True, v2=True
-            )
-
-        os.unlink(path)
         return ("%08x" % v1, "%08x" % v2)
 
     def _foundOffset(self, device, offset):
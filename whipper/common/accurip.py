@@ -19,14 +19,17 @@
 # You should have received a copy of the GNU General Public License
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
+import multiprocessing
 import requests
 import struct
+import wave
 from errno import EEXIST
 from os import makedirs
 from os.path import dirname, exists, join
+from subprocess import CalledProcessError
 
-from whipper.common import directory
-from whipper.program.arc import accuraterip_checksum
+from whipper.common import checksum, common, directory
+from whipper.common.common import MissingFrames
 
 import logging
 logger = logging.getLogger(__name__)
@@ -95,7 +98,31 @@ def _split_responses(raw_entry):
     return responses
 
 
-def calculate_checksums(track_paths):
+def _checksum_track(path, number, track_count):
+    """
+    Return the ARv1 and ARv2 checksums of the given track, in one pass
+    over its audio data. Files that are not .wav files are decoded with
+    flac, once for both checksums.
+    """
+    try:
+        try:
+            return checksum.accuraterip_checksums(path, number, track_count)
+        except wave.Error:
+            logger.debug('%r is not a .wav file, decoding it with flac',
+                         path)
+        return checksum.accuraterip_checksums(path, number, track_count,
+                                              is_wave=False)
+    except (IOError, EOFError, CalledProcessError, MissingFrames) as e:
+        logger.debug('could not read %r: %r', path, e)
+        return None, None
+
+
+def _checksum_track_star(args):
+    # Pool.map only passes a single argument
+    return _checksum_track(*args)
+
+
+def calculate_checksums(track_paths, workers=None):
     """
     Return ARv1 and ARv2 checksums as two arrays of character strings in a
     dictionary: {'v1': ['deadbeef', ...], 'v2': [...]}
@@ -103,25 +130,38 @@ def calculate_checksums(track_paths):
     Return None instead of checksum string for unchecksummable tracks.
 
     HTOA checksums are not included in the database and are not calculated.
+
+    @param workers: number of processes checksumming tracks concurrently;
+                    defaults to the number of CPUs
+    @type  workers: int or None
     """
     track_count = len(track_paths)
     v1_checksums = []
     v2_checksums = []
-    logger.debug('checksumming %d tracks', track_count)
-    # This is done sequentially because it is very fast.
-    for i, path in enumerate(track_paths):
-        v1_sum = accuraterip_checksum(
-            path, i+1, track_count, wave=True, v2=False
-        )
+    if not workers:
+        workers = common.getCPUCount()
+    workers = min(workers, track_count)
+    logger.debug('checksumming %d tracks with %d worker(s)',
+                 track_count, workers)
+    args = [(path, i + 1, track_count) for i, path in enumerate(track_paths)]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            # map keeps the results in track order
+            results = pool.map(_checksum_track_star, args, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = map(_checksum_track_star, args)
+
+    for i, (path, (v1_sum, v2_sum)) in enumerate(zip(track_paths, results)):
         if not v1_sum:
             logger.error('could not calculate AccurateRip v1 checksum '
                          'for track %d %r', i + 1, path)
             v1_checksums.append(None)
         else:
             v1_checksums.append("%08x" % v1_sum)
-        v2_sum = accuraterip_checksum(
-            path, i+1, track_count, wave=True, v2=True
-        )
         if not v2_sum:
             logger.error('could not calculate AccurateRip v2 checksum '
                          'for track %d %r', i + 1, path)
@@ -179,6 +219,20 @@ def get_db_entry(path):
     return _split_responses(raw_entry)
 
 
+def get_confident_checksums(responses, number, confidence):
+    """
+    Return the AccurateRip checksums, of either version, that at least
+    `confidence' submissions agree on for the given track.
+
+    `number' is the track number, as used by the responses; HTOA (0) has no
+    checksums.
+    """
+    i = number - 1
+    return set([r.checksums[i] for r in responses
+                if 0 <= i < len(r.checksums) and
+                r.confidences[i] >= confidence])
+
+
 def _assign_checksums_and_confidences(tracks, checksums, responses):
     for i, track in enumerate(tracks):
         for v in ('v1', 'v2'):
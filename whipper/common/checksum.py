@@ -18,47 +18,601 @@
 # You should have received a copy of the GNU General Public License
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
 import binascii
-import wave
-import tempfile
+import errno
+import itertools
+import operator
 import subprocess
-import os
-
+import sys
+import wave
 
+from whipper.common import common
 from whipper.extern.task import task as etask
+from whipper.program import flac
 
 import logging
 logger = logging.getLogger(__name__)
 
+try:
+    import numpy
+except ImportError:
+    logger.debug('cannot import numpy, using slower audio analysis')
+    numpy = None
+
 # checksums are not CRC's. a CRC is a specific type of checksum.
 
+# number of samples read at once; keeps memory usage flat regardless of
+# the length of the track being checksummed
+CHUNK_SAMPLES = common.SAMPLES_PER_FRAME * common.FRAMES_PER_SECOND * 5
+
+
+def _read_wave(path, sampleStart=0, sampleLength=-1):
+    """
+    Read the audio data of a .wav file in chunks of at most CHUNK_SAMPLES.
+
+    @param sampleStart:  first sample to read
+    @type  sampleStart:  int
+    @param sampleLength: number of samples to read; -1 to read until the end
+    @type  sampleLength: int
+
+    @raises common.MissingFrames: if the file has less samples than asked for
+    """
+    w = wave.open(path)
+    try:
+        available = w.getnframes() - sampleStart
+        if sampleLength < 0:
+            sampleLength = available
+        if sampleStart < 0 or sampleLength > available:
+            raise common.MissingFrames(
+                'asked for samples %d to %d, %r only has %d' % (
+                    sampleStart, sampleStart + sampleLength, path,
+                    w.getnframes()))
+
+        w.setpos(sampleStart)
+        remaining = sampleLength
+        while remaining > 0:
+            data = w.readframes(min(CHUNK_SAMPLES, remaining))
+            if not data:
+                raise common.MissingFrames(
+                    '%d samples missing from %r' % (remaining, path))
+            remaining -= len(data) / (w.getsampwidth() * w.getnchannels())
+            yield data
+    finally:
+        w.close()
+
+
+def _read_flac(path, sampleStart=0, sampleLength=-1):
+    """
+    Read the audio data of a .flac file in chunks of at most CHUNK_SAMPLES,
+    decoding it through a pipe instead of to a temporary file.
+
+    @param sampleStart:  first sample to read
+    @type  sampleStart:  int
+    @param sampleLength: number of samples to read; -1 to read until the end
+    @type  sampleLength: int
+
+    @raises common.MissingFrames: if the file has less samples than asked for
+    """
+    try:
+        p = flac.decode(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            raise common.MissingDependencyException('flac')
+        raise
+
+    try:
+        eof = False
+        skip = sampleStart * 4
+        while skip > 0 and not eof:
+            data = p.stdout.read(min(CHUNK_SAMPLES * 4, skip))
+            eof = not data
+            skip -= len(data)
+
+        remaining = sampleLength * 4
+        while remaining != 0 and not eof:
+            size = CHUNK_SAMPLES * 4
+            if remaining > 0:
+                size = min(size, remaining)
+            data = p.stdout.read(size)
+            eof = not data
+            remaining -= len(data)
+            if data:
+                yield data
+
+        if eof:
+            # only check how flac exited if we read all of its output
+            if p.wait():
+                raise subprocess.CalledProcessError(p.returncode, 'flac')
+        if skip > 0 or remaining > 0:
+            raise common.MissingFrames(
+                'asked for samples %d to %d, %r has less' % (
+                    sampleStart, sampleStart + sampleLength, path))
+    finally:
+        if p.poll() is None:
+            p.kill()
+            p.wait()
+        p.stdout.close()
+
 
 class CRC32Task(etask.Task):
-    # TODO: Support sampleStart, sampleLength later on (should be trivial, just
-    # add change the read part in _crc32 to skip some samples and/or not
-    # read too far)
+    """
+    I calculate the CRC32 of the audio data of a track, without keeping
+    more than a chunk of it in memory.
+
+    @ivar checksum: the CRC32 of the audio data, as an unsigned int
+    """
+
     def __init__(self, path, sampleStart=0, sampleLength=-1, is_wave=True):
+        """
+        @param is_wave:      whether path is a .wav file; if not, it is
+                             decoded with flac
+        @type  is_wave:      bool
+        @param sampleStart:  first sample to checksum
+        @type  sampleStart:  int
+        @param sampleLength: number of samples to checksum; -1 for all
+        @type  sampleLength: int
+        """
         self.path = path
         self.is_wave = is_wave
+        self._sampleStart = sampleStart
+        self._sampleLength = sampleLength
+        self.checksum = None
 
     def start(self, runner):
         etask.Task.start(self, runner)
         self.schedule(0.0, self._crc32)
 
     def _crc32(self):
-        if not self.is_wave:
-            fd, tmpf = tempfile.mkstemp()
+        read = self.is_wave and _read_wave or _read_flac
+        crc = 0
+        for data in read(self.path, self._sampleStart, self._sampleLength):
+            crc = binascii.crc32(data, crc)
+
+        self.checksum = crc & 0xffffffff
+        self.stop()
+
+
+class AccurateRipChecksum(object):
+    """
+    I calculate the AccurateRip v1 and v2 checksums of a track in one pass,
+    from its audio data fed to me in chunks of any size.
 
-            try:
-                subprocess.check_call(['flac', '-d', self.path, '-fo', tmpf])
+    I give the same results as accuraterip-checksum, including skipping
+    the first and last five sectors of the first and last track.
 
-                w = wave.open(tmpf)
-            finally:
-                os.remove(tmpf)
+    @ivar v1: the AccurateRip v1 checksum; set by finish()
+    @ivar v2: the AccurateRip v2 checksum; set by finish()
+    """
+
+    v1 = None
+    v2 = None
+
+    # samples skipped at the start of the first and end of the last track
+    _SKIP = 5 * common.SAMPLES_PER_FRAME
+
+    def __init__(self, trackNumber, trackCount):
+        """
+        @param trackNumber: number of the track on the disc, starting at 1
+        @type  trackNumber: int
+        @param trackCount:  number of audio tracks on the disc
+        @type  trackCount:  int
+        """
+        self._first = trackNumber == 1
+        self._last = trackNumber == trackCount
+        # the weight of the next sample; accuraterip-checksum counts from 1
+        self._position = 1
+        self._sum = 0
+        self._hi = 0
+        # bytes not checksummed yet: a partial sample, or the tail of the
+        # last track, which we only know to skip once all data is in
+        self._pending = ''
+
+    def update(self, data):
+        """
+        Add the next chunk of audio data to the checksums.
+
+        @type data: str
+        """
+        data = self._pending + data
+        hold = len(data) % 4
+        if self._last:
+            hold = min(len(data), hold + self._SKIP * 4)
+        self._pending = data[len(data) - hold:]
+        self._add(data[:len(data) - hold])
+
+    def finish(self):
+        """
+        Return the checksums of all data fed so far.
+
+        @rtype: tuple of (int, int)
+        """
+        if not self._last:
+            self._add(self._pending[:len(self._pending) - (
+                len(self._pending) % 4)])
+            self._pending = ''
+        self.v1 = self._sum & 0xffffffff
+        # each sample contributes the low and high dword of its 64 bit
+        # weighted value to v2; the low dwords together are just v1
+        self.v2 = (self._sum + self._hi) & 0xffffffff
+        return self.v1, self.v2
+
+    def _add(self, data):
+        count = len(data) / 4
+        position = self._position
+        self._position += count
+
+        if self._first and position < self._SKIP:
+            skip = min(self._SKIP - position, count)
+            data = data[skip * 4:]
+            count -= skip
+            position += skip
+        if not count:
+            return
+
+        if numpy is not None:
+            values = numpy.frombuffer(data, dtype='<u4').astype(numpy.uint64)
+            values *= numpy.arange(position, position + count,
+                                   dtype=numpy.uint64)
+            # uint64 sums wrap around, which keeps the lower 32 bits intact
+            self._sum += int(values.sum())
+            self._hi += int((values >> numpy.uint64(32)).sum())
+        else:
+            values = array.array('I', data)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            values = map(operator.mul, values,
+                         xrange(position, position + count))
+            self._sum += sum(values)
+            self._hi += sum(itertools.imap(operator.rshift, values,
+                                           itertools.repeat(32)))
+        self._sum &= 0xffffffff
+        self._hi &= 0xffffffff
+
+
+class AccurateRipOffsetChecksums(object):
+    """
+    I calculate the AccurateRip checksums a track would have when read at
+    different read offsets, from a single read of the track and the samples
+    around it.
+
+    The v1 checksums for a range of offsets are calculated by sliding the
+    track over the data, updating the weighted sum for each offset instead
+    of recalculating it.
+    """
+
+    def __init__(self, data, lead, length, trackNumber, trackCount):
+        """
+        @param data:        audio data of the track and the samples around it
+        @type  data:        str
+        @param lead:        number of samples in data before the track start
+        @type  lead:        int
+        @param length:      length of the track, in samples
+        @type  length:      int
+        @param trackNumber: number of the track on the disc, starting at 1
+        @type  trackNumber: int
+        @param trackCount:  number of audio tracks on the disc
+        @type  trackCount:  int
+        """
+        self._data = data
+        self._lead = lead
+        self._length = length
+        self._trackNumber = trackNumber
+        self._trackCount = trackCount
+
+        if numpy is not None:
+            self._values = numpy.frombuffer(data, dtype='<u4')
         else:
-            w = wave.open(self.path)
+            self._values = array.array('I', data)
+            if sys.byteorder == 'big':
+                self._values.byteswap()
+
+        # the 1-based positions in the track that are weighted
+        self._from = 1
+        self._to = length
+        if trackNumber == 1:
+            self._from = AccurateRipChecksum._SKIP
+        if trackNumber == trackCount:
+            self._to -= AccurateRipChecksum._SKIP
+
+    def _fits(self, offset):
+        return 0 <= self._lead + offset and \
+            self._lead + offset + self._length <= len(self._values)
+
+    def checksums(self, offset):
+        """
+        Calculate the v1 and v2 checksums of the track at the given offset.
+
+        @rtype: tuple of (int, int)
+        """
+        assert self._fits(offset), 'offset %d is out of range' % offset
+        start = (self._lead + offset) * 4
+        arc = AccurateRipChecksum(self._trackNumber, self._trackCount)
+        arc.update(self._data[start:start + self._length * 4])
+        return arc.finish()
+
+    def v1(self, offsets):
+        """
+        Calculate the v1 checksums of the track at the given offsets.
+
+        Offsets for which there is not enough data are left out.
+
+        @type  offsets: list of int
+        @rtype:         dict of int -> int
+        """
+        offsets = [o for o in offsets if self._fits(o)]
+        if not offsets:
+            return {}
+        first, last = min(offsets), max(offsets)
+        wanted = set(offsets)
+
+        # index in the data of the first sample of the track at offset first
+        k = self._lead + first - 1
+        v1 = self.checksums(first)[0]
+        values = self._values
+        if numpy is not None:
+            total = int(values[k + self._from:k + self._to + 1].sum(
+                dtype=numpy.uint64))
+        else:
+            total = sum(values[k + self._from:k + self._to + 1])
+
+        ret = {}
+        for offset in range(first, last + 1):
+            if offset in wanted:
+                ret[offset] = v1
+            if offset == last:
+                break
+            # every weight goes down by one when sliding one sample further;
+            # the first weighted sample drops out, a new last one comes in
+            leaving = int(values[k + self._from])
+            entering = int(values[k + self._to + 1])
+            v1 = (v1 - total - (self._from - 1) * leaving +
+                  self._to * entering) & 0xffffffff
+            total += entering - leaving
+            k += 1
+
+        return ret
+
+
+def accuraterip_checksums(path, trackNumber, trackCount, is_wave=True):
+    """
+    Calculate the AccurateRip v1 and v2 checksums of a .wav or .flac file,
+    reading or decoding it only once.
+
+    @param is_wave: whether path is a .wav file; if not, it is decoded
+                    with flac
+    @type  is_wave: bool
+
+    @rtype: tuple of (int, int)
+    """
+    read = is_wave and _read_wave or _read_flac
+    arc = AccurateRipChecksum(trackNumber, trackCount)
+    for data in read(path):
+        arc.update(data)
+    return arc.finish()
+
+
+class PeakLevel(object):
+    """
+    I find the peak level of 16 bit audio data fed to me in chunks of any
+    size, as the maximum absolute sample value, like sox stats does.
+
+    @ivar peak: the peak level of all data fed so far
+    """
+
+    def __init__(self):
+        self.peak = 0
+        self._pending = ''
+
+    def update(self, data):
+        """
+        Add the next chunk of audio data.
+
+        @type data: str
+        """
+        if self._pending:
+            data = self._pending + data
+        hold = len(data) % 2
+        self._pending = data[len(data) - hold:]
+        data = data[:len(data) - hold]
+        if not data:
+            return
+
+        if numpy is not None:
+            values = numpy.frombuffer(data, dtype='<i2')
+            self.peak = max(self.peak, int(values.max()), -int(values.min()))
+        else:
+            values = array.array('h', data)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            self.peak = max(self.peak, max(values), -min(values))
+
+
+class TrackAnalysis(object):
+    """
+    I analyze audio data fed to me in chunks of any size, calculating its
+    CRC32, AccurateRip checksums and peak level at once.
+
+    My results are set when L{finish} is called.
+
+    @ivar checksum: the CRC32 of the audio data
+    @ivar arv1:     the AccurateRip v1 checksum; None without a track number
+    @ivar arv2:     the AccurateRip v2 checksum; None without a track number
+    @ivar peak:     the peak level, as the maximum absolute sample value
+    @ivar samples:  the number of samples analyzed
+    @ivar chunks:   the CRC32 of every chunk of chunkFrames frames; None
+                    without chunkFrames
+    """
+
+    checksum = None
+    arv1 = None
+    arv2 = None
+    peak = None
+    samples = None
+    chunks = None
+
+    def __init__(self, trackNumber=None, trackCount=None, chunkFrames=None):
+        """
+        @param trackNumber: number of the track on the disc; AccurateRip
+                            checksums are only calculated if given
+        @type  trackNumber: int
+        @param trackCount:  number of audio tracks on the disc
+        @type  trackCount:  int
+        @param chunkFrames: if given, also calculate the CRC32 of every
+                            chunk of this many frames, to locate errors
+        @type  chunkFrames: int
+        """
+        self._arc = None
+        if trackNumber:
+            self._arc = AccurateRipChecksum(trackNumber, trackCount)
+        self._peak = PeakLevel()
+        self._crc = 0
+        self._bytes = 0
+        self._chunks = None
+        if chunkFrames:
+            self._chunks = []
+            self._chunkBytes = chunkFrames * common.BYTES_PER_FRAME
+            self._chunkCrc = 0
+
+    def update(self, data):
+        """
+        Add the next chunk of audio data.
+
+        @type data: str
+        """
+        self._crc = binascii.crc32(data, self._crc)
+        if self._arc:
+            self._arc.update(data)
+        self._peak.update(data)
+        if self._chunks is not None:
+            self._updateChunks(data)
+        self._bytes += len(data)
+
+    def _updateChunks(self, data):
+        start = 0
+        while start < len(data):
+            # bytes left in the current chunk
+            left = self._chunkBytes - self._bytes % self._chunkBytes
+            part = buffer(data, start, left)
+            self._chunkCrc = binascii.crc32(part, self._chunkCrc)
+            start += len(part)
+            self._bytes += len(part)
+            if len(part) == left:
+                self._chunks.append(self._chunkCrc & 0xffffffff)
+                self._chunkCrc = 0
+        self._bytes -= len(data)
+
+    def finish(self):
+        if self._chunks is not None:
+            if self._bytes % self._chunkBytes:
+                self._chunks.append(self._chunkCrc & 0xffffffff)
+            self.chunks = self._chunks
+        self.checksum = self._crc & 0xffffffff
+        if self._arc:
+            self.arv1, self.arv2 = self._arc.finish()
+        self.peak = self._peak.peak
+        self.samples = self._bytes / 4
+
+
+class SplitAnalysis(object):
+    """
+    I split audio data of consecutive tracks, fed to me in chunks of any
+    size, over the analyses of those tracks.
+    """
+
+    def __init__(self, analyses, lengths):
+        """
+        @param analyses: the analysis of each track, in order
+        @type  analyses: list of L{TrackAnalysis}
+        @param lengths:  the length of each track, in samples
+        @type  lengths:  list of int
+        """
+        self._analyses = analyses
+        self._lengths = [length * 4 for length in lengths]
+        self._track = 0
+        self._remaining = self._lengths and self._lengths[0]
+
+    def update(self, data):
+        """
+        Add the next chunk of audio data; data after the last track is
+        ignored.
+
+        @type data: str
+        """
+        while data and self._track < len(self._analyses):
+            part = data[:self._remaining]
+            self._analyses[self._track].update(part)
+            data = data[len(part):]
+            self._remaining -= len(part)
+            if not self._remaining:
+                self._track += 1
+                if self._track < len(self._lengths):
+                    self._remaining = self._lengths[self._track]
+
+    def finish(self):
+        for analysis in self._analyses:
+            analysis.finish()
+
+
+class TrackAnalysisTask(etask.Task):
+    """
+    I analyze the audio data of a .wav file in a single read, calculating
+    its CRC32, AccurateRip checksums and peak level at once.
+
+    @ivar checksum: the CRC32 of the audio data
+    @ivar arv1:     the AccurateRip v1 checksum; None without a track number
+    @ivar arv2:     the AccurateRip v2 checksum; None without a track number
+    @ivar peak:     the peak level, as the maximum absolute sample value
+    @ivar samples:  the number of samples analyzed
+    """
+
+    description = 'Analyzing track'
+
+    checksum = None
+    arv1 = None
+    arv2 = None
+    peak = None
+    samples = None
+
+    def __init__(self, path, trackNumber=None, trackCount=None):
+        """
+        @param trackNumber: number of the track on the disc; AccurateRip
+                            checksums are only calculated if given
+        @type  trackNumber: int
+        @param trackCount:  number of audio tracks on the disc
+        @type  trackCount:  int
+        """
+        self.path = path
+        self._analysis = TrackAnalysis(trackNumber, trackCount)
+        self._samples = 0
+
+    def start(self, runner):
+        etask.Task.start(self, runner)
+        w = wave.open(self.path)
+        self._total = w.getnframes()
+        w.close()
+        self._chunks = _read_wave(self.path)
+        self.schedule(0.0, self._analyze)
+
+    def _analyze(self):
+        # analyze a chunk at a time, so we can report progress
+        try:
+            data = next(self._chunks)
+        except StopIteration:
+            self._done()
+            return
 
-        d = w._data_chunk.read()
+        self._analysis.update(data)
+        self._samples += len(data) / 4
+        if self._total:
+            self.setProgress(float(self._samples) / self._total)
+        self.schedule(0.0, self._analyze)
 
-        self.checksum = binascii.crc32(d) & 0xffffffff
+    def _done(self):
+        a = self._analysis
+        a.finish()
+        self.checksum = a.checksum
+        self.arv1, self.arv2 = a.arv1, a.arv2
+        self.peak = a.peak
+        self.samples = a.samples
         self.stop()
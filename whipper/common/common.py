@@ -19,6 +19,7 @@
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import multiprocessing
 import os
 import os.path
 import math
@@ -293,6 +294,18 @@ def validate_template(template, kind):
                          'variable(s): {}'.format(', '.join(matches)))
 
 
+def getCPUCount():
+    """
+    Return the number of CPUs, or 1 if it cannot be determined.
+
+    @rtype: int
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
 class VersionGetter(object):
     """
     I get the version of a program by looking for it in command output
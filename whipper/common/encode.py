@@ -18,50 +18,152 @@
 # You should have received a copy of the GNU General Public License
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
+import Queue
+import errno
+import os
+import subprocess
+import threading
+import time
 
 from mutagen.flac import FLAC
 
+from whipper.common import common, staging
 from whipper.extern.task import task
 
-from whipper.program import sox
 from whipper.program import flac
 
 import logging
 logger = logging.getLogger(__name__)
 
+# bounds the number of flac encoders running at once, across all processes
+# sharing it; see limitEncoders
+_slots = None
 
-class SoxPeakTask(task.Task):
-    description = 'Calculating peak level'
 
-    def __init__(self, track_path):
-        self.track_path = track_path
-        self.peak = None
+def limitEncoders(slots):
+    """
+    Limit the number of tracks encoded at once, by this process and the
+    processes it forks, to the value of a shared semaphore.
 
-    def start(self, runner):
-        task.Task.start(self, runner)
-        self.schedule(0.0, self._sox_peak)
+    @param slots: the semaphore to take a slot of while encoding; None to
+                  not limit encoding
+    @type  slots: L{multiprocessing.BoundedSemaphore} or None
+    """
+    global _slots
+    _slots = slots
 
-    def _sox_peak(self):
-        self.peak = sox.peak_level(self.track_path)
-        self.stop()
+
+def _encode(infile, outfile, skip=0, until=None):
+    if _slots is None:
+        return flac.encode(infile, outfile, skip, until)
+    with _slots:
+        return flac.encode(infile, outfile, skip, until)
 
 
 class FlacEncodeTask(task.Task):
     description = 'Encoding to FLAC'
 
-    def __init__(self, track_path, track_out_path, what="track"):
+    def __init__(self, track_path, track_out_path, what="track", skip=0,
+                 until=None):
+        """
+        @param skip:  first sample of track_path to encode
+        @type  skip:  int
+        @param until: sample of track_path to stop encoding at (exclusive);
+                      None to encode until the end
+        @type  until: int or None
+        """
         self.track_path = track_path
         self.track_out_path = track_out_path
         self.new_path = None
         self.description = 'Encoding %s to FLAC' % what
+        self._skip = skip
+        self._until = until
 
     def start(self, runner):
         task.Task.start(self, runner)
-        self.schedule(0.0, self._flac_encode)
+        # encode on a thread, so other tasks run by the same runner can go
+        # on meanwhile; it wakes the runner up through a pipe when done
+        self._wakeup, w = os.pipe()
+        t = threading.Thread(target=self._flac_encode, args=(w, ),
+                             name='flac')
+        t.daemon = True
+        t.start()
+        self.watch(self._wakeup, self._encoded)
+
+    def _flac_encode(self, w):
+        try:
+            self.new_path = _encode(self.track_path, self.track_out_path,
+                                    self._skip, self._until)
+        except Exception as e:
+            self.setException(e)
+        finally:
+            os.close(w)
 
-    def _flac_encode(self):
-        self.new_path = flac.encode(self.track_path, self.track_out_path)
+    def _encoded(self):
+        os.close(self._wakeup)
         self.stop()
+        return False
+
+
+class FlacStream(object):
+    """
+    I encode the .wav data written to me to FLAC, with flac reading it from
+    a pipe, so it never has to be stored uncompressed.
+
+    Like the other encoders, flac only starts once it got a slot; see
+    limitEncoders.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._popen = None
+        self._slot = False
+
+    def write(self, data):
+        if not self._popen:
+            self._start()
+        try:
+            self._popen.stdin.write(data)
+        except Exception:
+            # flac is of no use any more; make room for other encoders
+            if self._popen.poll() is None:
+                self._popen.kill()
+            self._popen.wait()
+            self._release()
+            raise
+
+    def _start(self):
+        if _slots is not None:
+            _slots.acquire()
+            self._slot = True
+        try:
+            self._popen = flac.encode_stream(self.path)
+        except OSError as e:
+            self._release()
+            if e.errno == errno.ENOENT:
+                raise common.MissingDependencyException('flac')
+            raise
+
+    def _release(self):
+        if self._slot:
+            self._slot = False
+            _slots.release()
+
+    def close(self):
+        """
+        Wait for flac to finish encoding.
+
+        @raises subprocess.CalledProcessError: if flac failed
+        """
+        if not self._popen:
+            return
+        try:
+            self._popen.stdin.close()
+            if self._popen.wait():
+                raise subprocess.CalledProcessError(self._popen.returncode,
+                                                    'flac')
+        finally:
+            self._release()
 
 
 class TaggingTask(task.Task):
@@ -81,11 +183,114 @@ class TaggingTask(task.Task):
         self.schedule(0.0, self._tag)
 
     def _tag(self):
-        w = FLAC(self.track_path)
+        _write_tags(self.track_path, self.tags)
+        self.stop()
 
-        for k, v in list(self.tags.items()):
-            w[k] = v
 
-        w.save()
+def _write_tags(path, tags):
+    w = FLAC(path)
 
-        self.stop()
+    for k, v in list(tags.items()):
+        w[k] = v
+
+    w.save()
+
+
+class EncodePool(object):
+    """
+    I encode and tag ripped tracks on background threads, so the drive can
+    read the next track in the meantime.
+
+    At most staged tracks wait for a free worker; submitting more blocks
+    until one is picked up, which bounds the number of .wav files left in
+    the temporary directory.
+
+    @ivar durations: the seconds spent encoding and tagging each track, by
+                     the path it was moved to
+    @type durations: dict of unicode -> float
+    """
+
+    def __init__(self, workers=None, staged=2):
+        """
+        @param workers: number of tracks encoded at once; defaults to the
+                        number of CPUs
+        @type  workers: int or None
+        @param staged:  number of ripped tracks that can wait to be encoded
+        @type  staged:  int
+        """
+        if not workers:
+            workers = common.getCPUCount()
+        self._queue = Queue.Queue(staged)
+        self._failed = []
+        self.durations = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work, name='encode-%d' % i)
+            # don't keep whipper alive when it is interrupted
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, wavpath, partpath, path, tags, skip=0, until=None,
+               delete=True):
+        """
+        Encode wavpath to partpath, tag it and move it to path.
+
+        @type  tags:   dict
+        @param skip:   first sample of wavpath to encode
+        @type  skip:   int
+        @param until:  sample of wavpath to stop encoding at (exclusive)
+        @type  until:  int or None
+        @param delete: whether to delete wavpath afterwards, whether
+                       encoding worked or not
+        @type  delete: bool
+        """
+        logger.debug('queueing %r for encoding', wavpath)
+        if delete:
+            staging.handOff(wavpath)
+        self._queue.put((wavpath, partpath, path, tags, skip, until, delete))
+
+    def join(self):
+        """
+        Wait until all submitted tracks are encoded, and stop the workers.
+        Joining again returns right away.
+
+        @returns: the tracks that failed, as (path, exception) tuples
+        @rtype:   list
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        return self._failed
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self._encode(*job)
+            except Exception as e:
+                logger.warning('encoding %r failed: %r', job[2], e)
+                with self._lock:
+                    self._failed.append((job[2], e))
+
+    def _encode(self, wavpath, partpath, path, tags, skip, until, delete):
+        start = time.time()
+        try:
+            _encode(wavpath, partpath, skip, until)
+            _write_tags(partpath, tags)
+            logger.debug('moving to final path %r', path)
+            os.rename(partpath, path)
+            with self._lock:
+                self.durations[path] = time.time() - start
+        except Exception:
+            if os.path.exists(partpath):
+                os.unlink(partpath)
+            raise
+        finally:
+            if delete:
+                staging.release(wavpath)
@@ -0,0 +1,260 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_metrics -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# This file is part of whipper.
+#
+# whipper is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whipper is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whipper.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Metrics of a rip, exported for monitoring drives.
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+# the values recorded for each track, with their Prometheus metric and help
+_TRACK_METRICS = [
+    ('tries', 'whipper_track_tries',
+     'Number of times the track was read and verified.'),
+    ('scsi_errors', 'whipper_track_scsi_errors',
+     'Number of SCSI read errors cd-paranoia reported for the track.'),
+    ('bytes_read', 'whipper_track_read_bytes',
+     'Bytes of audio read from the disc for the track.'),
+    ('bytes_written', 'whipper_track_written_bytes',
+     'Size of the encoded track.'),
+    ('encode_seconds', 'whipper_track_encode_seconds',
+     'Seconds spent encoding and tagging the track.'),
+]
+
+
+class Metrics(object):
+    """
+    I record how long the phases of a rip take and how reading each track
+    went, and export them as JSON or as a Prometheus textfile.
+
+    Phases are for example reading the TOC, looking up metadata or
+    checksumming; the test and copy reads and the encoding of the tracks
+    add up to the read_test, read_copy and encode phases.
+
+    @ivar phases: seconds spent in each phase, by name
+    @type phases: dict of str -> float
+    @ivar tracks: values recorded for each track, by track number
+    @type tracks: dict of int -> dict
+    @ivar totals: values recorded for the rip as a whole, like the errors
+                  of a whole disc read
+    @type totals: dict of str -> int
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.tracks = {}
+        self.totals = {}
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Time the block run in this context as the given phase.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.addPhase(name, time.time() - start)
+
+    def addPhase(self, name, seconds):
+        """
+        Add the given time to a phase.
+
+        @type seconds: float
+        """
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def addTrack(self, number, **values):
+        """
+        Add the given values to the ones recorded for a track, for example
+        read_test_seconds, read_copy_seconds, encode_seconds, tries,
+        scsi_errors or bytes_read.
+
+        @param number: the track number (0 for HTOA)
+        @type  number: int
+        """
+        track = self.tracks.setdefault(number, {})
+        for key, value in values.items():
+            track[key] = track.get(key, 0) + value
+
+    def addTotal(self, **values):
+        """
+        Add the given values to the ones recorded for the rip as a whole.
+        """
+        for key, value in values.items():
+            self.totals[key] = self.totals.get(key, 0) + value
+
+    def collect(self, ripResult, device=None):
+        """
+        Return the metrics of the rip.
+
+        @type  ripResult: L{whipper.result.result.RipResult}
+        @param device:    the device the disc was ripped from
+
+        @rtype: dict
+        """
+        phases = dict(self.phases)
+        totals = dict([(key, 0) for key, _, _ in _TRACK_METRICS
+                       if key != 'encode_seconds'])
+        totals.update(self.totals)
+        tracks = []
+        for trackResult in ripResult.tracks:
+            track = {
+                'number': trackResult.number,
+                'read_test_seconds': 0.0,
+                'read_copy_seconds': 0.0,
+                'encode_seconds': 0.0,
+                'tries': 0,
+                'scsi_errors': 0,
+                'bytes_read': 0,
+            }
+            track.update(self.tracks.get(trackResult.number, {}))
+            track['retries'] = max(track['tries'] - 1, 0)
+            track['bytes_written'] = 0
+            if trackResult.filename and os.path.exists(trackResult.filename):
+                track['bytes_written'] = os.path.getsize(trackResult.filename)
+            track['paranoia'] = trackResult.paranoia
+            track['quality'] = trackResult.quality
+            tracks.append(track)
+
+            for phase, key in (('read_test', 'read_test_seconds'),
+                               ('read_copy', 'read_copy_seconds'),
+                               ('encode', 'encode_seconds')):
+                phases[phase] = phases.get(phase, 0.0) + track[key]
+            for key in totals:
+                totals[key] += track.get(key, 0)
+        totals['retries'] = sum([t['retries'] for t in tracks])
+
+        table = ripResult.table
+        return {
+            'device': device,
+            'drive': {
+                'vendor': ripResult.vendor,
+                'model': ripResult.model,
+                'release': ripResult.release,
+            },
+            'offset': ripResult.offset,
+            'cddb_disc_id': table and table.getCDDBDiscId(),
+            'musicbrainz_disc_id': table and table.getMusicBrainzDiscId(),
+            'started': self.started,
+            'duration': time.time() - self.started,
+            'phases': phases,
+            'tracks': tracks,
+            'totals': totals,
+        }
+
+    def writeJSON(self, path, ripResult, device=None):
+        """
+        Write the metrics of the rip to the given path as JSON.
+        """
+        logger.debug('writing metrics to %r', path)
+        with open(path, 'w') as f:
+            json.dump(self.collect(ripResult, device), f, indent=2,
+                      separators=(',', ': '), sort_keys=True)
+
+    def writePrometheus(self, path, ripResult, device=None):
+        """
+        Write the metrics of the rip to the given path in the Prometheus
+        text format, for the textfile collector of node_exporter.
+
+        The file is replaced atomically, so it is never read half written.
+        """
+        logger.debug('writing Prometheus metrics to %r', path)
+        metrics = self.collect(ripResult, device)
+        drive = metrics['drive']
+        labels = {
+            'device': device or '',
+            'drive': ' '.join([(drive[k] or '').strip()
+                               for k in ('vendor', 'model')]),
+        }
+
+        lines = []
+
+        def add(name, help, samples):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            for extra, value in samples:
+                d = dict(labels)
+                d.update(extra)
+                lines.append('%s{%s} %s' % (name, _labels(d), value))
+
+        add('whipper_rip_timestamp_seconds',
+            'Time the last rip finished, in seconds since the epoch.',
+            [({}, _value(metrics['started'] + metrics['duration']))])
+        add('whipper_rip_duration_seconds', 'Seconds the last rip took.',
+            [({}, _value(metrics['duration']))])
+        add('whipper_rip_phase_seconds',
+            'Seconds the last rip spent in each phase.',
+            [({'phase': phase}, _value(seconds))
+             for phase, seconds in sorted(metrics['phases'].items())])
+        add('whipper_rip_retries', 'Tracks read again in the last rip.',
+            [({}, _value(metrics['totals']['retries']))])
+        add('whipper_rip_scsi_errors',
+            'SCSI read errors cd-paranoia reported in the last rip.',
+            [({}, _value(metrics['totals']['scsi_errors']))])
+        add('whipper_rip_read_bytes',
+            'Bytes of audio read from the disc in the last rip.',
+            [({}, _value(metrics['totals']['bytes_read']))])
+        add('whipper_rip_written_bytes',
+            'Bytes of encoded tracks the last rip wrote.',
+            [({}, _value(metrics['totals']['bytes_written']))])
+
+        tracks = metrics['tracks']
+        add('whipper_track_read_seconds',
+            'Seconds spent reading the track, by read.',
+            [({'track': str(t['number']), 'read': read},
+              _value(t['read_%s_seconds' % read]))
+             for t in tracks for read in ('test', 'copy')])
+        for key, name, help in _TRACK_METRICS:
+            add(name, help, [({'track': str(t['number'])}, _value(t[key]))
+                             for t in tracks])
+
+        fd, tmppath = tempfile.mkstemp(
+            prefix='.' + os.path.basename(path),
+            dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.chmod(tmppath, 0o644)
+            os.rename(tmppath, path)
+        except Exception:
+            os.unlink(tmppath)
+            raise
+
+
+def _value(value):
+    # Python 2 writes long integers with an L
+    if isinstance(value, float):
+        return repr(value)
+    return '%d' % value
+
+
+def _labels(d):
+    # the label values escaped as the text format requires
+    return ','.join([
+        '%s="%s"' % (k, unicode(v).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n').encode('utf-8'))
+        for k, v in sorted(d.items())])
@@ -27,7 +27,9 @@ import re
 import os
 import time
 
-from whipper.common import accurip, cache, checksum, common, mbngs, path
+from whipper.common import (
+    accurip, cache, checksum, common, encode, mbngs, metrics, path, staging
+)
 from whipper.program import cdrdao, cdparanoia
 from whipper.image import image
 from whipper.extern import freedb
@@ -48,6 +50,8 @@ class Program:
     @type metadata: L{mbngs.DiscMetadata}
     @ivar result:   the rip's result
     @type result:   L{result.RipResult}
+    @ivar metrics:  timings and counts of the rip, for monitoring
+    @type metrics:  L{metrics.Metrics}
     @type outdir:   unicode
     @type config:   L{whipper.common.config.Config}
     """
@@ -58,6 +62,8 @@ class Program:
     outdir = None
     result = None
 
+    _disc = None  # ReadVerifyDiscTask of a whole disc read
+
     def __init__(self, config, record=False):
         """
         @param record: whether to record results of API calls for playback.
@@ -65,6 +71,7 @@ class Program:
         self._record = record
         self._cache = cache.ResultCache()
         self._config = config
+        self.metrics = metrics.Metrics()
 
         d = {}
 
@@ -470,42 +477,82 @@ class Program:
             else:
                 raise
 
-        ret = trackResult.testcrc == t.checksum
+        # the test read is skipped for tracks matching AccurateRip, and
+        # does not match a repaired copy read
+        crc = trackResult.testcrc
+        if crc is None or trackResult.rereads:
+            crc = trackResult.copycrc
+        ret = crc == t.checksum
         logger.debug('verifyTrack: track result crc %r, file crc %r, '
-                     'result %r', trackResult.testcrc, t.checksum, ret)
+                     'result %r', crc, t.checksum, ret)
         return ret
 
     def ripTrack(self, runner, trackResult, offset, device, taglist,
-                 overread, what=None):
+                 overread, what=None, encoder=None, stream=False,
+                 accuraterip=None, paranoia='full'):
         """
         Ripping the track may change the track's filename as stored in
         trackResult.
 
         @param trackResult: the object to store information in.
         @type  trackResult: L{result.TrackResult}
+        @param encoder:     if given, the track is encoded and tagged on it
+                            in the background instead of before returning
+        @type  encoder:     L{whipper.common.encode.EncodePool}
+        @param stream:      whether to encode the track while it is read,
+                            without storing it as a .wav file; encoder is
+                            not used then
+        @type  stream:      bool
+        @param accuraterip: AccurateRip checksums, as hex strings, that
+                            verify the track without a test read
+        @type  accuraterip: set of str
+        @param paranoia:    the paranoia level to read with, one of
+                            L{cdparanoia.PARANOIA_LEVELS}
+        @type  paranoia:    str
         """
-        if trackResult.number == 0:
-            start, stop = self.getHTOA()
-        else:
-            start = self.result.table.getTrackStart(trackResult.number)
-            stop = self.result.table.getTrackEnd(trackResult.number)
+        start, stop = self._getTrackRange(trackResult.number)
 
         dirname = os.path.dirname(trackResult.filename)
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
+        if self._disc and trackResult.number in self._disc.copyanalyses:
+            test = self._disc.testanalyses.pop(trackResult.number)
+            copy = self._disc.copyanalyses.pop(trackResult.number)
+            if test.checksum == copy.checksum:
+                self._splitTrack(runner, trackResult, start, stop, test, copy,
+                                 taglist, encoder)
+                return
+            logger.warning('track %d did not verify when reading the disc, '
+                           'reading it again', trackResult.number)
+
         if not what:
             what = 'track %d' % (trackResult.number, )
 
+        trackCount = self.result.table.getAudioTracks()
         t = cdparanoia.ReadVerifyTrackTask(trackResult.filename,
                                            self.result.table, start,
                                            stop, overread,
                                            offset=offset,
                                            device=device,
                                            taglist=taglist,
-                                           what=what)
+                                           what=what,
+                                           trackNumber=trackResult.number,
+                                           trackCount=trackCount,
+                                           encode=encoder is None,
+                                           stream=stream,
+                                           accuraterip=accuraterip,
+                                           paranoia=paranoia)
 
-        runner.run(t)
+        try:
+            runner.run(t)
+        finally:
+            # failed tries count too
+            self.metrics.addTrack(trackResult.number,
+                                  scsi_errors=t.errors or 0,
+                                  encode_seconds=t.encodeduration)
+        if encoder and not stream:
+            encoder.submit(t.wavpath, t.partpath, t.path, taglist)
 
         logger.debug('ripped track')
         logger.debug('test speed %.3f/%.3f seconds',
@@ -514,7 +561,14 @@ class Program:
                      t.copyspeed, t.copyduration)
         trackResult.testcrc = t.testchecksum
         trackResult.copycrc = t.copychecksum
+        trackResult.rereads = t.rereads
+        trackResult.paranoia = t.paranoia
+        trackResult.hotspots = t.hotspots
         trackResult.peak = t.peak
+        # AccurateRip checksums get calculated while ripping; keep them for
+        # verifyImage
+        for v, arc in (('v1', t.arv1), ('v2', t.arv2)):
+            trackResult.AR[v]['CRC'] = None if arc is None else '%08x' % arc
         trackResult.quality = t.quality
         trackResult.testspeed = t.testspeed
         trackResult.copyspeed = t.copyspeed
@@ -522,11 +576,120 @@ class Program:
         trackResult.testduration += t.testduration
         trackResult.copyduration += t.copyduration
 
+        # the test read is skipped if the copy read matches AccurateRip
+        reads = 1 if t.testchecksum is None else 2
+        frames = (stop - start + 1) * reads + sum(
+            [(last - first + 1) * cdparanoia.RereadTask.REREADS
+             for first, last in t.rereads])
+        self.metrics.addTrack(trackResult.number,
+                              read_test_seconds=t.testduration,
+                              read_copy_seconds=t.copyduration,
+                              bytes_read=frames * common.BYTES_PER_FRAME)
+
         if trackResult.filename != t.path:
             trackResult.filename = t.path
             logger.info('filename changed to %r', trackResult.filename)
 
-    def verifyImage(self, runner, table):
+    def _getTrackRange(self, number):
+        # return the first and last frame of the given track, or HTOA
+        if number == 0:
+            return self.getHTOA()
+        return (self.result.table.getTrackStart(number),
+                self.result.table.getTrackEnd(number))
+
+    def ripDisc(self, runner, numbers, offset, device, overread,
+                paranoia='full'):
+        """
+        Read and verify the given consecutive tracks in one continuous test
+        read and copy read, for ripTrack to encode them from.
+
+        @param numbers:  the track numbers to read, in order; 0 for HTOA
+        @type  numbers:  list of int
+        @param paranoia: the paranoia level to read with, one of
+                         L{cdparanoia.PARANOIA_LEVELS}
+        @type  paranoia: str
+        """
+        tracks = [(n, ) + tuple(self._getTrackRange(n)) for n in numbers]
+        t = cdparanoia.ReadVerifyDiscTask(
+            self.result.table, tracks, overread, offset=offset,
+            device=device, trackCount=self.result.table.getAudioTracks(),
+            paranoia=paranoia)
+        try:
+            runner.run(t)
+        finally:
+            self.metrics.addTotal(scsi_errors=t.errors or 0)
+
+        logger.debug('ripped disc')
+        logger.debug('test speed %.3f/%.3f seconds',
+                     t.testspeed, t.testduration)
+        logger.debug('copy speed %.3f/%.3f seconds',
+                     t.copyspeed, t.copyduration)
+        self._disc = t
+
+    def removeDisc(self):
+        """
+        Remove the .wav file of the disc read by ripDisc, once all of its
+        tracks are encoded.
+        """
+        if self._disc:
+            logger.debug('removing %r', self._disc.wavpath)
+            staging.release(self._disc.wavpath)
+            self._disc = None
+
+    def _splitTrack(self, runner, trackResult, start, stop, test, copy,
+                    taglist, encoder):
+        # encode the track from the whole disc read instead of reading it
+        disc = self._disc
+        skip = (start - disc.startFrame) * common.SAMPLES_PER_FRAME
+        until = (stop + 1 - disc.startFrame) * common.SAMPLES_PER_FRAME
+
+        filename, partpath = cdparanoia.partPath(trackResult.filename)
+        if encoder:
+            encoder.submit(disc.wavpath, partpath, filename, taglist,
+                           skip=skip, until=until, delete=False)
+        else:
+            encodeStart = time.time()
+            try:
+                runner.run(encode.FlacEncodeTask(
+                    disc.wavpath, partpath, skip=skip, until=until,
+                    what='track %d' % trackResult.number))
+                runner.run(encode.TaggingTask(partpath, taglist))
+                os.rename(partpath, filename)
+            except Exception:
+                os.unlink(partpath)
+                raise
+            self.metrics.addTrack(trackResult.number,
+                                  encode_seconds=time.time() - encodeStart)
+
+        trackResult.testcrc = test.checksum
+        trackResult.copycrc = copy.checksum
+        trackResult.rereads = []
+        trackResult.paranoia = disc.paranoia
+        trackResult.hotspots = [(max(first, start), min(last, stop), reads)
+                                for first, last, reads in disc.hotspots
+                                if first <= stop and last >= start]
+        trackResult.peak = copy.peak
+        for v, arc in (('v1', copy.arv1), ('v2', copy.arv2)):
+            trackResult.AR[v]['CRC'] = None if arc is None else '%08x' % arc
+        trackResult.quality = disc.quality
+        trackResult.testspeed = disc.testspeed
+        trackResult.copyspeed = disc.copyspeed
+        # attribute the time spent reading to tracks by their length
+        share = float(stop - start + 1) / (
+            disc.stopFrame - disc.startFrame + 1)
+        trackResult.testduration += disc.testduration * share
+        trackResult.copyduration += disc.copyduration * share
+        self.metrics.addTrack(
+            trackResult.number,
+            read_test_seconds=disc.testduration * share,
+            read_copy_seconds=disc.copyduration * share,
+            bytes_read=(stop - start + 1) * 2 * common.BYTES_PER_FRAME)
+
+        if trackResult.filename != filename:
+            trackResult.filename = filename
+            logger.info('filename changed to %r', trackResult.filename)
+
+    def verifyImage(self, runner, table, workers=None):
         """
         verify table against accuraterip and cue_path track lengths
         Verify our image against the given AccurateRip responses.
@@ -535,22 +698,41 @@ class Program:
         Will set accurip and friends on each TrackResult.
 
         Populates self.result.tracks with above TrackResults.
+
+        @param workers: number of tracks scanned and checksummed at once;
+                        defaults to the number of CPUs
+        @type  workers: int or None
         """
         cueImage = image.Image(self.cuePath)
         # assigns track lengths
-        verifytask = image.ImageVerifyTask(cueImage)
-        runner.run(verifytask)
+        verifytask = image.ImageVerifyTask(cueImage, workers=workers)
+        with self.metrics.phase('checksum'):
+            runner.run(verifytask)
         if verifytask.exception:
             logger.error(verifytask.exceptionMessage)
             return False
 
-        responses = accurip.get_db_entry(table.accuraterip_path())
+        with self.metrics.phase('accuraterip'):
+            responses = accurip.get_db_entry(table.accuraterip_path())
         logger.info('%d AccurateRip response(s) found', len(responses))
 
-        checksums = accurip.calculate_checksums([
-            os.path.join(os.path.dirname(self.cuePath), t.indexes[1].path)
-            for t in [t for t in cueImage.cue.table.tracks if t.number != 0]
-        ])
+        tracks = [t for t in cueImage.cue.table.tracks if t.number != 0]
+        trackResults = [self.result.getTrackResult(t.number) for t in tracks]
+        if all([tr and tr.AR['v1']['CRC'] and tr.AR['v2']['CRC']
+                for tr in trackResults]):
+            # calculated while ripping, no need to read the tracks again
+            logger.debug('using AccurateRip checksums from the rip')
+            checksums = dict([
+                (v, [tr.AR[v]['CRC'] for tr in trackResults])
+                for v in ('v1', 'v2')
+            ])
+        else:
+            with self.metrics.phase('checksum'):
+                checksums = accurip.calculate_checksums([
+                    os.path.join(os.path.dirname(self.cuePath),
+                                 t.indexes[1].path)
+                    for t in tracks
+                ], workers=workers)
         if not (checksums and any(checksums['v1']) and any(checksums['v2'])):
             return False
         return accurip.verify_result(self.result, responses, checksums)
@@ -599,3 +781,21 @@ class Program:
         self.logPath = logPath
 
         return logPath
+
+    def writeMetrics(self, discName, device=None, textfile=None):
+        """
+        Write the metrics of the rip as JSON next to the log, and optionally
+        as a Prometheus textfile.
+
+        @param device:   the device the disc was ripped from
+        @type  device:   str
+        @param textfile: where to write the metrics in the Prometheus text
+                         format
+        @type  textfile: str or None
+        """
+        metricsPath = common.truncate_filename(discName + '.metrics.json')
+        self.metrics.writeJSON(metricsPath, self.result, device)
+        if textfile:
+            self.metrics.writePrometheus(textfile, self.result, device)
+
+        return metricsPath
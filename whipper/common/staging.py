@@ -0,0 +1,137 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_staging -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+# This file is part of whipper.
+#
+# whipper is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# whipper is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with whipper.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Staging of the intermediate .wav files of a rip.
+"""
+
+import os
+import tempfile
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Staging(object):
+    """
+    I create the intermediate .wav files of a rip in a staging directory,
+    for example on a tmpfs such as /dev/shm, keeping the bytes staged there
+    within a budget.
+
+    Files that do not fit in the budget wait for files handed off to other
+    threads, like the encoding pool, to be released; if that does not make
+    room, they are created in the default temporary directory instead,
+    outside of the budget.  Without a staging directory, the budget applies
+    to the default temporary directory.
+    """
+
+    def __init__(self, directory=None, budget=None):
+        """
+        @param directory: where to stage files; None for the default
+                          temporary directory
+        @type  directory: str or None
+        @param budget:    the number of bytes that can be staged at once;
+                          None for no limit
+        @type  budget:    int or None
+        """
+        self.directory = directory
+        self.budget = budget
+        self._sizes = {}  # path -> size of staged files
+        self._handedOff = set()
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def create(self, size, suffix='.whipper.wav'):
+        """
+        Create a file to stage size bytes in.
+
+        @type  size:   int
+        @type  suffix: str
+
+        @returns: the path of the created, empty file
+        @rtype:   unicode
+        """
+        with self._cond:
+            if self.budget is not None:
+                while (self._used + size > self.budget and
+                       self._handedOff & set(self._sizes)):
+                    logger.debug('waiting for %d staged bytes to be '
+                                 'released', size)
+                    self._cond.wait()
+
+            directory = self.directory
+            staged = True
+            if self.budget is not None and \
+                    self._used + size > self.budget:
+                logger.debug('%d bytes do not fit in the staging budget',
+                             size)
+                directory = None
+                staged = False
+
+            fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+            os.close(fd)
+            path = unicode(path)
+            if staged:
+                self._sizes[path] = size
+                self._used += size
+            logger.debug('staging %d bytes in %r, %d staged', size, path,
+                         self._used)
+            return path
+
+    def handOff(self, path):
+        """
+        Note that another thread will release the given file; files waiting
+        for room in the budget can wait for it.
+        """
+        with self._cond:
+            self._handedOff.add(path)
+
+    def release(self, path):
+        """
+        Delete the given file if it exists, and free its bytes.
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+        with self._cond:
+            self._used -= self._sizes.pop(path, 0)
+            self._handedOff.discard(path)
+            self._cond.notify_all()
+
+
+_staging = Staging()
+
+
+def configure(directory=None, budget=None):
+    """
+    Configure where intermediate files are staged; see L{Staging}.
+    """
+    global _staging
+    _staging = Staging(directory, budget)
+
+
+def create(size, suffix='.whipper.wav'):
+    return _staging.create(size, suffix)
+
+
+def handOff(path):
+    _staging.handOff(path)
+
+
+def release(path):
+    _staging.release(path)
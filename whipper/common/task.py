@@ -31,6 +31,7 @@ class PopenTask(task.Task):
 
     logCategory = 'PopenTask'
     bufsize = 1024
+    readsize = 65536  # bytes read at once when output is available
     command = None
     cwd = None
 
@@ -53,44 +54,57 @@ class PopenTask(task.Task):
 
         logger.debug('started %r with pid %d', self.command, self._popen.pid)
 
-        self.schedule(1.0, self._read, runner)
-
-    def _read(self, runner):
+        # read output as soon as there is some, until both pipes are closed
+        self._open = ['stdout', 'stderr']
+        self._failure = None
+        self.watch(self._popen.stdout.fileno(), self._read, 'stdout',
+                   self.readbytesout)
+        self.watch(self._popen.stderr.fileno(), self._read, 'stderr',
+                   self.readbyteserr)
+
+    def _read(self, which, handler):
+        if not self.runner:
+            # stopped already
+            return False
         try:
-            read = False
-
-            ret = self._popen.recv()
-
-            if ret:
-                logger.debug("read from stdout: %s", ret)
-                self.readbytesout(ret)
-                read = True
-
-            ret = self._popen.recv_err()
-
-            if ret:
-                logger.debug("read from stderr: %s", ret)
-                self.readbyteserr(ret)
-                read = True
-
-            # if we read anything, we might have more to read, so
-            # reschedule immediately
-            if read and self.runner:
-                self.schedule(0.0, self._read, runner)
-                return
-
-            # if we didn't read anything, give the command more time to
-            # produce output
-            if self._popen.poll() is None and self.runner:
-                # not finished yet
-                self.schedule(1.0, self._read, runner)
-                return
-
-            self._done()
+            ret = os.read(getattr(self._popen, which).fileno(),
+                          self.readsize)
+            if not ret:
+                return self._closed(which)
+
+            # after a failure, only drain the pipes until the command exits
+            if not self._failure:
+                logger.debug("read from %s: %s", which, ret)
+                handler(ret)
+            return True
         except Exception as e:
             logger.debug('exception during _read(): %s', e)
+            if self._failure:
+                # the pipe is broken; stop watching it
+                return self._closed(which)
             self.setException(e)
-            self.stop()
+            self._failure = e
+            if self._popen.poll() is None:
+                self._popen.terminate()
+            return True
+
+    def _closed(self, which):
+        # stop once both pipes are closed, and only then, so the task is
+        # stopped exactly once whichever pipe closes last
+        self._open.remove(which)
+        if not self._open:
+            self._popen.wait()
+            if self._failure:
+                self.stop()
+                return False
+            try:
+                self._done()
+            except Exception as e:
+                logger.debug('exception during _done(): %s', e)
+                self.setException(e)
+                if self.runner:
+                    self.stop()
+        return False
 
     def _done(self):
         assert self._popen.returncode is not None, "No returncode"
@@ -27,6 +27,8 @@ try:
 except ImportError:
     import gobject
 
+from whipper.common import common
+
 logger = logging.getLogger(__name__)
 
 
@@ -221,6 +223,19 @@ class Task(LogStub):
             return
         self.runner.schedule(self, delta, callable, *args, **kwargs)
 
+    def watch(self, fd, callable, *args):
+        """
+        Call callable with the given arguments whenever fd can be read
+        without blocking, which includes end of file, for as long as it
+        returns True.
+        """
+        if not self.runner:
+            import traceback
+            logger.error("watching on a task that's already stopped\n%s",
+                         ''.join(traceback.format_stack()))
+            return
+        self.runner.watch(self, fd, callable, *args)
+
     def addListener(self, listener):
         """
         Add a listener for task status changes.
@@ -409,7 +424,7 @@ class MultiSeparateTask(BaseMultiTask):
     def progressed(self, task, value):
         self.setProgress(value)
 
-    def described(self, description):
+    def described(self, task, description):
         self.setDescription("%s (%d of %d) ..." % (
             description, self._task, len(self.tasks)))
 
@@ -433,6 +448,127 @@ class MultiCombinedTask(BaseMultiTask):
         BaseMultiTask.stopped(self, task)
 
 
+class MultiParallelTask(BaseMultiTask):
+    """
+    I perform multiple tasks, running up to a number of them at once.
+
+    Tasks are started in the order they were added.  If a task fails, no
+    more tasks are started, and I stop with its exception once the running
+    ones stopped.
+    I track progress as a combined progress on all tasks.
+
+    @ivar workers: the maximum number of tasks to run at once
+    @type workers: int
+    """
+
+    description = 'Doing various tasks in parallel'
+    workers = 1
+
+    def __init__(self, workers=None):
+        """
+        @param workers: the maximum number of tasks to run at once;
+                        defaults to the number of CPUs
+        @type  workers: int or None
+        """
+        BaseMultiTask.__init__(self)
+        if not workers:
+            workers = common.getCPUCount()
+        self.workers = workers
+        self._started = set()
+        self._done = set()
+        self._running = []
+
+    def start(self, runner):
+        Task.start(self, runner)
+
+        self._generic = self.description
+        if not self.tasks:
+            self.warning('no tasks')
+            self.stop()
+            return
+
+        self.next()
+
+    def next(self):
+        """
+        Start the next tasks, up to the number of workers.
+        """
+        for task in self.tasks:
+            # tasks can stop while being started, and stop me
+            if not self.running or self.exception or \
+                    len(self._running) >= self.workers:
+                break
+            if task in self._started:
+                continue
+
+            self._started.add(task)
+            self._running.append(task)
+            self.debug('MultiParallelTask.next(): starting task %d of %d: '
+                       '%r', self.tasks.index(task) + 1, len(self.tasks),
+                       task)
+            try:
+                task.addListener(self)
+                task.start(self.runner)
+            except Exception as e:
+                self._running.remove(task)
+                self.setException(e)
+                self.debug('Got exception during next: %r',
+                           self.exceptionMessage)
+
+        if not self.running:
+            return
+        if not self._running:
+            self.stop()
+            return
+        self._describe()
+
+    def _describe(self, description=None):
+        # description is the new one of the running task, which it only
+        # takes after notifying
+        if len(self._running) == 1:
+            task = self._running[0]
+            self.setDescription("%s (%d of %d) ..." % (
+                description or task.description,
+                self.tasks.index(task) + 1, len(self.tasks)))
+        else:
+            self.setDescription("%s (%d running, %d of %d done) ..." % (
+                self._generic, len(self._running), len(self._done),
+                len(self.tasks)))
+
+    # ITaskListener methods
+    def progressed(self, task, value):
+        self.setProgress(float(len(self._done) + sum(
+            [t.progress for t in self._running])) / len(self.tasks))
+
+    def described(self, task, description):
+        if len(self._running) == 1:
+            self._describe(description)
+
+    def stopped(self, task):
+        self.debug('MultiParallelTask.stopped: task %r (%d of %d)',
+                   task, self.tasks.index(task) + 1, len(self.tasks))
+        if task in self._running:
+            self._running.remove(task)
+        if task.exception:
+            self.warning('MultiParallelTask.stopped: exception %r',
+                         task.exceptionMessage)
+            if not self.exception:
+                self.exception = task.exception
+                self.exceptionMessage = task.exceptionMessage
+        else:
+            self._done.add(task)
+        self.progressed(task, 0.0)
+
+        if len(self._done) == len(self.tasks) or \
+                (self.exception and not self._running):
+            self.debug('MultiParallelTask.stopped: all tasks done')
+            self.stop()
+            return
+
+        if not self.exception:
+            self.schedule(0, self.next)
+
+
 class TaskRunner(LogStub):
     """
     I am a base class for task runners.
@@ -460,6 +596,16 @@ class TaskRunner(LogStub):
         """
         raise NotImplementedError
 
+    def watch(self, task, fd, callable, *args):
+        """
+        Call callable whenever fd can be read, until it returns False.
+
+        Subclasses should implement this.
+
+        @type  fd: int
+        """
+        raise NotImplementedError
+
 
 class SyncRunner(TaskRunner, ITaskListener):
     """
@@ -528,6 +674,21 @@ class SyncRunner(TaskRunner, ITaskListener):
 
         gobject.timeout_add(int(delta * 1000L), c)
 
+    def watch(self, task, fd, callable, *args):
+        def c(source, condition):
+            try:
+                return callable(*args)
+            except Exception as e:
+                self.debug('exception when calling watching callable %r',
+                           callable)
+                task.setException(e)
+                self.stopped(task)
+                raise
+        self.debug('watch: watching %d for %r(*args=%r)', fd, callable, args)
+
+        gobject.io_add_watch(fd, gobject.IO_IN | gobject.IO_PRI |
+                             gobject.IO_ERR | gobject.IO_HUP, c)
+
     # ITaskListener methods
     def progressed(self, task, value):
         if not self._verboseRun:
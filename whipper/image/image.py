@@ -66,13 +66,17 @@ class Image(object):
 
         return self.cue.getRealPath(path)
 
-    def setup(self, runner):
+    def setup(self, runner, workers=None):
         """
         Do initial setup, like figuring out track lengths, and
         constructing the Table of Contents.
+
+        @param workers: number of tracks scanned at once; defaults to the
+                        number of CPUs
+        @type  workers: int or None
         """
         logger.debug('setup image start')
-        verify = ImageVerifyTask(self)
+        verify = ImageVerifyTask(self, workers=workers)
         logger.debug('verifying image')
         runner.run(verify)
         logger.debug('verified image')
@@ -107,9 +111,11 @@ class Image(object):
         logger.debug('setup image done')
 
 
-class ImageVerifyTask(task.MultiSeparateTask):
+class ImageVerifyTask(task.MultiParallelTask):
     """
     I verify a disk image and get the necessary track lengths.
+
+    The lengths of the tracks are scanned concurrently.
     """
 
     logCategory = 'ImageVerifyTask'
@@ -117,8 +123,13 @@ class ImageVerifyTask(task.MultiSeparateTask):
     description = "Checking tracks"
     lengths = None
 
-    def __init__(self, image):
-        task.MultiSeparateTask.__init__(self)
+    def __init__(self, image, workers=None):
+        """
+        @param workers: number of tracks scanned at once; defaults to the
+                        number of CPUs
+        @type  workers: int or None
+        """
+        task.MultiParallelTask.__init__(self, workers)
 
         self._image = image
         cue = image.cue
@@ -169,7 +180,7 @@ class ImageVerifyTask(task.MultiSeparateTask):
             end = taskk.length / common.SAMPLES_PER_FRAME
             self.lengths[trackIndex] = end - index.relative
 
-        task.MultiSeparateTask.stop(self)
+        task.MultiParallelTask.stop(self)
 
 
 class ImageEncodeTask(task.MultiSeparateTask):
@@ -18,6 +18,8 @@
 # You should have received a copy of the GNU General Public License
 # along with whipper.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
+import binascii
 import errno
 import os
 import re
@@ -27,9 +29,8 @@ import subprocess
 import tempfile
 import time
 
-from whipper.common import common
+from whipper.common import common, staging
 from whipper.common import task as ctask
-from whipper.extern import asyncsub
 from whipper.extern.task import task
 
 import logging
@@ -64,15 +65,19 @@ class ChecksumException(Exception):
     pass
 
 
-# example:
+# matches the progress and error lines in a block of output, e.g.
 # ##: 0 [read] @ 24696
-_PROGRESS_RE = re.compile(r"""
-    ^\#\#: (?P<code>.+)\s         # function code
-    \[(?P<function>.*)\]\s@\s     # [function name] @
-    (?P<offset>\d+)               # offset in words (2-byte one channel value)
-""", re.VERBOSE)
-
-_ERROR_RE = re.compile("^scsi_read error:")
+# scsi_read error: sector=-2 length=1 retry=3
+_OUTPUT_RE = re.compile(r"""
+    ^(?:
+        \#\#:\ (?P<code>.+)[ \t]       # function code
+        \[(?P<function>.*)\][ \t]@[ \t] # [function name] @
+        (?P<offset>\d+)               # offset in words (2-byte one channel
+                                      # value)
+    |
+        (?P<error>scsi_read\ error:)
+    )
+""", re.VERBOSE | re.MULTILINE)
 
 # from reading cdparanoia source code, it looks like offset is reported in
 # number of single-channel samples, ie. 2 bytes (word) per unit, and absolute
@@ -99,25 +104,52 @@ class ProgressParser:
         # FIXME: privatize
         self.read = start
 
-        self._reads = {}  # read count for each sector
+        # differences between the read counts of consecutive frames, from
+        # start up to and including stop + 1, so counting a read of a range
+        # of frames takes constant time
+        self._reads = array.array('i', [0]) * (stop - start + 2)
+
+        self._tail = ""  # the last line fed, until it is complete
 
     def parse(self, line):
         """
         Parse a line.
         """
-        m = _PROGRESS_RE.search(line)
-        if m:
-            # code = int(m.group('code'))
+        self._parse(line)
+
+    def feed(self, data):
+        """
+        Parse output as it comes in.
+
+        Only complete lines are parsed; the last line is kept until the
+        rest of it is fed.
+
+        @type data: str
+        """
+        end = data.rfind("\n")
+        if end == -1:
+            self._tail += data
+            return
+
+        block = self._tail + data[:end]
+        self._tail = data[end + 1:]
+        self._parse(block)
+
+    def _parse(self, block):
+        # scan the whole block at once; of the [wrote] lines, only the last
+        # one matters
+        wrote = None
+        for m in _OUTPUT_RE.finditer(block):
             function = m.group('function')
-            wordOffset = int(m.group('offset'))
             if function == 'read':
-                self._parse_read(wordOffset)
+                self._parse_read(int(m.group('offset')))
             elif function == 'wrote':
-                self._parse_wrote(wordOffset)
+                wrote = m.group('offset')
+            elif m.group('error'):
+                self.errors += 1
 
-        m = _ERROR_RE.search(line)
-        if m:
-            self.errors += 1
+        if wrote is not None:
+            self._parse_wrote(int(wrote))
 
     def _parse_read(self, wordOffset):
         if wordOffset % common.WORDS_PER_FRAME != 0:
@@ -158,13 +190,6 @@ class ProgressParser:
             markStart = frameOffset  # - self._firstFrames
             markEnd = frameOffset
 
-        # FIXME: doing this is way too slow even for a testcase, so disable
-        if False:
-            for frame in range(markStart, markEnd):
-                if frame not in list(self._reads.keys()):
-                    self._reads[frame] = 0
-                self._reads[frame] += 1
-
         # cdparanoia reads quite a bit beyond the current track before it
         # goes back to verify; don't count those
         # markStart, markEnd of 0, 21 with stop 0 should give 1 read
@@ -175,6 +200,12 @@ class ProgressParser:
 
         self.reads += markEnd - markStart
 
+        first = max(markStart, self.start) - self.start
+        last = max(markEnd, self.start) - self.start
+        if first < last:
+            self._reads[first] += 1
+            self._reads[last] -= 1
+
         # update our read pointer
         self.read = frameOffset
 
@@ -183,6 +214,44 @@ class ProgressParser:
         frameOffset = (wordOffset + 1) / common.WORDS_PER_FRAME
         self.wrote = frameOffset
 
+    def getReadCounts(self):
+        """
+        Return how many times each frame of the track was read.
+
+        @returns: the read counts, from start to stop
+        @rtype:   list of int
+        """
+        counts = []
+        count = 0
+        for difference in self._reads[:-1]:
+            count += difference
+            counts.append(count)
+        return counts
+
+    def getHotspots(self, reads=3):
+        """
+        Return the ranges of frames that were read at least the given number
+        of times; cdparanoia reads each frame twice if it has no trouble.
+
+        @returns: (first, last, most) tuples of the first and last frame of
+                  each range, inclusive, and the most reads of a frame in it
+        @rtype:   list of tuple of (int, int, int)
+        """
+        hotspots = []
+        first = None
+        most = 0
+        for frame, count in enumerate(self.getReadCounts() + [0]):
+            if count >= reads:
+                if first is None:
+                    first = frame
+                    most = 0
+                most = max(most, count)
+            elif first is not None:
+                hotspots.append((self.start + first, self.start + frame - 1,
+                                 most))
+                first = None
+        return hotspots
+
     def getTrackQuality(self):
         """
         Each frame gets read twice.
@@ -203,27 +272,59 @@ class ProgressParser:
 # FIXME: handle errors
 
 
+# paranoia levels, from fastest to most careful, with their arguments
+PARANOIA_LEVELS = ('none', 'overlap', 'full')
+_PARANOIA_ARGS = {
+    'none': ['--disable-paranoia'],
+    'overlap': ['--disable-extra-paranoia'],
+    'full': [],
+}
+
+
+def adaptiveParanoia(attempt):
+    """
+    Return the paranoia level to read with on the given attempt, starting
+    without paranoia and escalating to full paranoia for tracks that do not
+    verify.
+
+    @param attempt: the number of earlier attempts to rip the track
+    @type  attempt: int
+
+    @rtype: str
+    """
+    return PARANOIA_LEVELS[min(attempt, len(PARANOIA_LEVELS) - 1)]
+
+
 class ReadTrackTask(task.Task):
     """
     I am a task that reads a track using cdparanoia.
 
-    @ivar reads: how many reads were done to rip the track
+    @ivar reads:    how many reads were done to rip the track
+    @ivar hotspots: the ranges of frames that were read more often than
+                    usual; see L{ProgressParser.getHotspots}
+    @ivar errors:   the number of SCSI errors cd-paranoia reported
     """
 
     description = "Reading track"
     quality = None  # set at end of reading
+    hotspots = None  # set at end of reading
+    errors = None  # set at end of reading
     speed = None
     duration = None  # in seconds
 
     _MAXERROR = 100  # number of errors detected by parser
+    _FOLLOW_BYTES = common.BYTES_PER_FRAME * common.FRAMES_PER_SECOND * 5
+    _READ_BYTES = 65536  # of progress output at once
 
     def __init__(self, path, table, start, stop, overread, offset=0,
-                 device=None, action="Reading", what="track"):
+                 device=None, action="Reading", what="track", analysis=None,
+                 sink=None, paranoia='full'):
         """
         Read the given track.
 
-        @param path:   where to store the ripped track
-        @type  path:   unicode
+        @param path:   where to store the ripped track; None to stream it
+                       from cd-paranoia's stdout without storing it
+        @type  path:   unicode or None
         @param table:  table of contents of CD
         @type  table:  L{table.Table}
         @param start:  first frame to rip
@@ -238,8 +339,18 @@ class ReadTrackTask(task.Task):
         @type  action: str
         @param what:   a string representing what's being read; e.g. Track
         @type  what:   str
+        @param analysis: fed the audio data while cd-paranoia writes it,
+                         and finished when the read is done
+        @type  analysis: L{whipper.common.checksum.TrackAnalysis}
+        @param sink:   when streaming, written the .wav data as it comes in
+                       and closed when the read is done
+        @type  sink:   file-like object
+        @param paranoia: the paranoia level to read with; one of
+                         L{PARANOIA_LEVELS}
+        @type  paranoia: str
         """
-        assert isinstance(path, unicode), "%r is not unicode" % path
+        assert path is None or isinstance(path, unicode), \
+            "%r is not unicode" % path
 
         self.path = path
         self._table = table
@@ -250,8 +361,13 @@ class ReadTrackTask(task.Task):
         self._device = device
         self._start_time = None
         self._overread = overread
+        self._analysis = analysis
+        self._follower = None
+        self._sink = sink
+        self._sinkError = None
+        self._streamed = 0  # bytes of the stream, with the wav header
+        self._paranoia = paranoia
 
-        self._buffer = ""  # accumulate characters
         self._errors = []
         self.description = "%s %s" % (action, what)
 
@@ -278,27 +394,29 @@ class ReadTrackTask(task.Task):
                      startOffset)
         logger.debug('stopping at track %d, offset %d', stopTrack, stopOffset)
 
-        bufsize = 1024
         if self._overread:
             argv = ["cd-paranoia", "--stderr-progress",
                     "--sample-offset=%d" % self._offset, "--force-overread", ]
         else:
             argv = ["cd-paranoia", "--stderr-progress",
                     "--sample-offset=%d" % self._offset, ]
+        argv.extend(_PARANOIA_ARGS[self._paranoia])
         if self._device:
             argv.extend(["--force-cdrom-device", self._device, ])
         argv.extend(["%d[%s]-%d[%s]" % (
             startTrack, common.framesToHMSF(startOffset),
             stopTrack, common.framesToHMSF(stopOffset)),
-            self.path])
+            self.path or '-'])
         logger.debug('running %s', (" ".join(argv), ))
+        if self._analysis and self.path:
+            # make sure we never follow what a previous read left behind
+            open(self.path, 'wb').close()
         try:
-            self._popen = asyncsub.Popen(argv,
-                                         bufsize=bufsize,
-                                         stdin=subprocess.PIPE,
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE,
-                                         close_fds=True)
+            self._popen = subprocess.Popen(argv,
+                                           stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE,
+                                           close_fds=True)
         except OSError as e:
             import errno
             if e.errno == errno.ENOENT:
@@ -307,66 +425,171 @@ class ReadTrackTask(task.Task):
             raise
 
         self._start_time = time.time()
-        self.schedule(1.0, self._read, runner)
+        # handle output as soon as cd-paranoia writes it; we are done when
+        # it closed its pipes
+        self._open = ['stderr']
+        self._failure = None
+        self.watch(self._popen.stderr.fileno(), self._handle, 'stderr',
+                   self._read)
+        if not self.path:
+            self._open.append('stdout')
+            self.watch(self._popen.stdout.fileno(), self._handle, 'stdout',
+                       self._stream)
+
+    def _handle(self, which, handler):
+        # after a failure, only drain the pipes until cd-paranoia exits
+        try:
+            if not self._failure:
+                return handler()
+            if os.read(getattr(self._popen, which).fileno(),
+                       self._READ_BYTES):
+                return True
+            return self._closed(which)
+        except Exception as e:
+            logger.debug('exception handling %s: %r', which, e)
+            if self._failure:
+                # the pipe is broken; stop watching it
+                return self._closed(which)
+            self.setException(e)
+            self._failure = e
+            if self._popen.poll() is None:
+                self._popen.terminate()
+            return True
+
+    def _closed(self, which):
+        # stop once both pipes are closed, and only then, so the task is
+        # stopped exactly once whichever pipe closes last
+        self._open.remove(which)
+        if not self._open:
+            self._popen.wait()
+            if self._failure:
+                self._abort()
+                return False
+            try:
+                self._done()
+            except Exception as e:
+                logger.debug('exception when done: %r', e)
+                self.setException(e)
+                if self.runner:
+                    self.stop()
+        return False
+
+    def _abort(self):
+        # leave nothing open after a failure
+        if self._follower:
+            self._follower.close()
+            self._follower = None
+        if self._sink and not self._sinkError:
+            try:
+                self._sink.close()
+            except Exception as e:
+                logger.warning('could not close stream: %r', e)
+        self.stop()
 
-    def _read(self, runner):
-        ret = self._popen.recv_err()
+    def _read(self):
+        # cd-paranoia reported progress
+        ret = os.read(self._popen.stderr.fileno(), self._READ_BYTES)
         if not ret:
-            if self._popen.poll() is not None:
-                self._done()
-                return
-            self.schedule(0.01, self._read, runner)
+            return self._closed('stderr')
+
+        # keep the analysis up to date with the audio written so far
+        self._follow()
+        self._parser.feed(ret)
+
+        # fail if too many errors
+        if self._parser.errors > self._MAXERROR:
+            logger.debug('%d errors, terminating', self._parser.errors)
+            self._popen.terminate()
+
+        num = self._parser.wrote - self._start + 1
+        den = self._stop - self._start + 1
+        assert den != 0, "stop %d should be >= start %d" % (
+            self._stop, self._start)
+        progress = float(num) / float(den)
+        if progress < 1.0:
+            self.setProgress(progress)
+
+        return True
+
+    def _follow(self, final=False):
+        # feed the audio cd-paranoia wrote so far to the analysis, so it is
+        # complete as soon as the read is
+        if not self.path:
+            if final:
+                self._finishStream()
+            return
+        if not self._analysis:
             return
 
-        self._buffer += ret
-
-        # parse buffer into lines if possible, and parse them
-        if "\n" in self._buffer:
-            lines = self._buffer.split('\n')
-            if lines[-1] != "\n":
-                # last line didn't end yet
-                self._buffer = lines[-1]
-                del lines[-1]
-            else:
-                self._buffer = ""
-
-            for line in lines:
-                self._parser.parse(line)
-
-            # fail if too many errors
-            if self._parser.errors > self._MAXERROR:
-                logger.debug('%d errors, terminating', self._parser.errors)
+        if not self._follower:
+            self._follower = open(self.path, 'rb')
+            # skip the wav header
+            self._follower.seek(44)
+
+        f = self._follower
+        end = 44 + (self._stop - self._start + 1) * common.BYTES_PER_FRAME
+        # only read what was written, so we never hit end of file
+        end = min(end, os.fstat(f.fileno()).st_size)
+        while f.tell() < end:
+            data = f.read(min(end - f.tell(), self._FOLLOW_BYTES))
+            self._analysis.update(data)
+            # a chunk at a time while reading, to keep up with stderr
+            if not final:
+                break
+
+        if final:
+            f.close()
+            self._follower = None
+            self._analysis.finish()
+
+    def _stream(self):
+        # hand the wav data cd-paranoia wrote to stdout to the sink, and the
+        # audio after the wav header to the analysis
+        data = os.read(self._popen.stdout.fileno(), self._FOLLOW_BYTES)
+        if not data:
+            return self._closed('stdout')
+
+        if self._sink and not self._sinkError:
+            try:
+                self._sink.write(data)
+            except Exception as e:
+                logger.warning('could not write stream: %r', e)
+                self._sinkError = e
                 self._popen.terminate()
 
-            num = self._parser.wrote - self._start + 1
-            den = self._stop - self._start + 1
-            assert den != 0, "stop %d should be >= start %d" % (
-                self._stop, self._start)
-            progress = float(num) / float(den)
-            if progress < 1.0:
-                self.setProgress(progress)
-
-        # 0 does not give us output before we complete, 1.0 gives us output
-        # too late
-        self.schedule(0.01, self._read, runner)
-
-    def _poll(self, runner):
-        if self._popen.poll() is None:
-            self.schedule(1.0, self._poll, runner)
-            return
-
-        self._done()
+        header = max(44 - self._streamed, 0)
+        self._streamed += len(data)
+        if self._analysis and len(data) > header:
+            self._analysis.update(data[header:])
+        return True
+
+    def _finishStream(self):
+        if self._analysis:
+            self._analysis.finish()
+        if self._sink and not self._sinkError:
+            try:
+                self._sink.close()
+            except Exception as e:
+                logger.warning('could not close stream: %r', e)
+                self._sinkError = e
 
     def _done(self):
         end_time = time.time()
+        self._follow(final=True)
         self.setProgress(1.0)
 
         # check if the length matches
-        size = os.stat(self.path)[stat.ST_SIZE]
+        if self.path:
+            size = os.stat(self.path)[stat.ST_SIZE]
+        else:
+            size = self._streamed
         # wav header is 44 bytes
         offsetLength = self._stop - self._start + 1
         expected = offsetLength * common.BYTES_PER_FRAME + 44
-        if size != expected:
+        if self._sinkError:
+            # cd-paranoia got stopped because of it
+            self.setAndRaiseException(self._sinkError)
+        elif size != expected:
             # FIXME: handle errors better
             logger.warning('file size %d did not match expected size %d',
                            size, expected)
@@ -376,7 +599,7 @@ class ReadTrackTask(task.Task):
             else:
                 logger.warning('non-integral amount of frames difference')
 
-            self.setAndRaiseException(FileSizeError(self.path,
+            self.setAndRaiseException(FileSizeError(self.path or u'-',
                                                     "File size %d did not "
                                                     "match expected "
                                                     "size %d" % (
@@ -390,6 +613,8 @@ class ReadTrackTask(task.Task):
                 self.exception = ReturnCodeError(self._popen.returncode)
 
         self.quality = self._parser.getTrackQuality()
+        self.hotspots = self._parser.getHotspots()
+        self.errors = self._parser.errors
         self.duration = end_time - self._start_time
         self.speed = (offsetLength / 75.0) / self.duration
 
@@ -397,6 +622,153 @@ class ReadTrackTask(task.Task):
         return
 
 
+def partPath(path):
+    """
+    Create the file a track gets encoded to before it is moved to path,
+    shortening path if it is too long.
+
+    @returns: the possibly shortened path, and the path of the created file
+    @rtype:   tuple of (unicode, unicode)
+    """
+    try:
+        tmpoutpath = path + u'.part'
+        open(tmpoutpath, 'wb').close()
+    except IOError as e:
+        if errno.ENAMETOOLONG != e.errno:
+            raise
+        path = common.truncate_filename(common.shrinkPath(path))
+        tmpoutpath = common.truncate_filename(path + u'.part')
+        open(tmpoutpath, 'wb').close()
+    return path, tmpoutpath
+
+
+class _Buffer(object):
+    """
+    I keep the .wav data streamed by a L{ReadTrackTask} in memory.
+    """
+
+    def __init__(self):
+        self._data = []
+
+    def write(self, data):
+        self._data.append(data)
+
+    def close(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self._data)
+
+
+class RereadTask(task.MultiSeparateTask):
+    """
+    I am a task that repairs the chunks of a ripped .wav file on which the
+    test and copy reads disagree.
+
+    I read the frames of those chunks again, and keep for every chunk the
+    version that at least two of the test, copy and new reads agree on.
+
+    @ivar ranges: the ranges of frames read again, inclusive
+    @type ranges: list of (int, int)
+    @ivar errors: the number of SCSI errors cd-paranoia reported in the
+                  new reads
+    @type errors: int
+    """
+
+    description = "Re-reading"
+    errors = None
+
+    REREADS = 2  # number of times each range is read again
+
+    def __init__(self, path, table, start, stop, overread, chunks,
+                 chunkFrames, testchunks, offset=0, device=None,
+                 what="track"):
+        """
+        @param path:        the ripped .wav file to repair
+        @type  path:        unicode
+        @param start:       first frame of the ripped file
+        @type  start:       int
+        @param stop:        last frame of the ripped file (inclusive)
+        @type  stop:        int
+        @param chunks:      the indexes of the chunks to repair, ascending
+        @type  chunks:      list of int
+        @param chunkFrames: the number of frames in a chunk
+        @type  chunkFrames: int
+        @param testchunks:  the CRC32 of every chunk of the test read
+        @type  testchunks:  list of int
+        """
+        task.MultiSeparateTask.__init__(self)
+
+        self._path = path
+        self._start = start
+        self._stop = stop
+        self._chunkFrames = chunkFrames
+        self._testchunks = testchunks
+
+        # merge adjacent chunks into ranges of frames
+        self.ranges = []
+        for i in chunks:
+            first = start + i * chunkFrames
+            last = min(first + chunkFrames - 1, stop)
+            if self.ranges and self.ranges[-1][1] == first - 1:
+                first = self.ranges.pop()[0]
+            self.ranges.append((first, last))
+
+        self._buffers = []
+        for first, last in self.ranges:
+            buffers = [_Buffer() for _ in range(self.REREADS)]
+            for b in buffers:
+                self.tasks.append(
+                    ReadTrackTask(None, table, first, last, overread,
+                                  offset=offset, device=device,
+                                  action="Re-reading", what=what, sink=b))
+            self._buffers.append(buffers)
+
+    def stop(self):
+        self.errors = sum([t.errors or 0 for t in self.tasks])
+        if not self.exception:
+            try:
+                self._repair()
+            except Exception as e:
+                self.setException(e)
+
+        task.MultiSeparateTask.stop(self)
+
+    def _repair(self):
+        handle = open(self._path, 'r+b')
+        try:
+            for (first, last), buffers in zip(self.ranges, self._buffers):
+                reads = [b.getvalue()[44:] for b in buffers]
+                for chunkFirst in range(first, last + 1, self._chunkFrames):
+                    self._repairChunk(handle, first, chunkFirst,
+                                      min(last - chunkFirst + 1,
+                                          self._chunkFrames), reads)
+        finally:
+            handle.close()
+
+    def _repairChunk(self, handle, first, chunkFirst, frames, reads):
+        size = frames * common.BYTES_PER_FRAME
+        offset = (chunkFirst - first) * common.BYTES_PER_FRAME
+        handle.seek(44 + (chunkFirst - self._start) * common.BYTES_PER_FRAME)
+        versions = [handle.read(size)]
+        versions.extend([r[offset:offset + size] for r in reads])
+        crcs = [binascii.crc32(v) & 0xffffffff for v in versions]
+        votes = crcs + [
+            self._testchunks[(chunkFirst - self._start) / self._chunkFrames]]
+
+        best = max(range(len(versions)), key=lambda i: votes.count(crcs[i]))
+        if votes.count(crcs[best]) < 2:
+            raise ChecksumException(
+                'no two reads agree on frames %d to %d' % (
+                    chunkFirst, chunkFirst + frames - 1))
+        logger.debug('frames %d to %d: %d of %d reads agree',
+                     chunkFirst, chunkFirst + frames - 1,
+                     votes.count(crcs[best]), len(votes))
+        if best:
+            handle.seek(-size, os.SEEK_CUR)
+            handle.write(versions[best])
+
+
 class ReadVerifyTrackTask(task.MultiSeparateTask):
     """
     I am a task that reads and verifies a track using cdparanoia.
@@ -406,9 +778,14 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
     example if the file name is too long.
 
     @ivar path:         the path where the file is to be stored.
-    @ivar checksum:     the checksum of the track; set if they match.
-    @ivar testchecksum: the test checksum of the track.
-    @ivar copychecksum: the copy checksum of the track.
+    @ivar checksum:     the checksum of the track; set if they match, if
+                        the copy read was repaired, or if the test read was
+                        skipped.
+    @ivar testchecksum: the test checksum of the track; None if the test
+                        read was skipped because the copy read matched
+                        AccurateRip.
+    @ivar copychecksum: the copy checksum of the track, after repairing it
+                        if it was.
     @ivar testspeed:    the test speed of the track, as a multiple of
                         track duration.
     @ivar copyspeed:    the copy speed of the track, as a multiple of
@@ -416,23 +793,58 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
     @ivar testduration: the test duration of the track, in seconds.
     @ivar copyduration: the copy duration of the track, in seconds.
     @ivar peak:         the peak level of the track
+    @ivar arv1:         the AccurateRip v1 checksum of the track; set if
+                        the track number was given.
+    @ivar arv2:         the AccurateRip v2 checksum of the track; set if
+                        the track number was given.
+    @ivar wavpath:      the ripped .wav file, left for the caller to
+                        encode to partpath if not encoding; None when
+                        streaming.
+    @ivar partpath:     the file to encode to before moving it to path.
+    @ivar rereads:      the ranges of frames read again to repair the
+                        copy read, inclusive; empty if none.
+    @ivar paranoia:     the paranoia level the test and copy read used.
+    @ivar hotspots:     the ranges of frames the copy read read more often
+                        than usual, as (first, last, reads) tuples.
+    @ivar errors:       the number of SCSI errors cd-paranoia reported in
+                        the test and copy read and in the reads repairing
+                        the copy; set even if they failed.
+    @ivar encodeduration: the time spent encoding and tagging the track,
+                          in seconds.
     """
 
     checksum = None
     testchecksum = None
     copychecksum = None
     peak = None
+    arv1 = None
+    arv2 = None
     quality = None
     testspeed = None
     copyspeed = None
     testduration = None
     copyduration = None
+    hotspots = None
+    errors = None
+    encodeduration = None
+
+    # frames in the chunks compared between the test and copy read
+    REREAD_FRAMES = common.FRAMES_PER_SECOND
+    # read the whole track again instead if more than this part of it
+    # differs
+    REREAD_MAX = 0.5
 
     _tmpwavpath = None
     _tmppath = None
+    _reread = None
+    _reanalysis = None
+    _testread = None
+    _copyread = None
 
     def __init__(self, path, table, start, stop, overread, offset=0,
-                 device=None, taglist=None, what="track"):
+                 device=None, taglist=None, what="track", trackNumber=None,
+                 trackCount=None, encode=True, stream=False,
+                 accuraterip=None, paranoia='full'):
         """
         @param path:    where to store the ripped track
         @type  path:    str
@@ -448,6 +860,26 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
         @type  device:  str
         @param taglist: a dict of tags
         @type  taglist: dict
+        @param trackNumber: the number of the track on the disc; needed to
+                            calculate AccurateRip checksums
+        @type  trackNumber: int
+        @param trackCount:  the number of audio tracks on the disc
+        @type  trackCount:  int
+        @param encode:  whether to encode and tag the track; if not, the
+                        verified .wav file is left at wavpath
+        @type  encode:  bool
+        @param stream:  whether to stream the reads from cd-paranoia, and
+                        encode the copy read while it comes in, instead of
+                        storing it as a .wav file first; implies encode
+        @type  stream:  bool
+        @param accuraterip: AccurateRip checksums, as hex strings, that
+                            verify the track; if given, the copy read is
+                            done first, and the test read is skipped if
+                            it matches one of them
+        @type  accuraterip: set of str
+        @param paranoia:    the paranoia level to read with; the chunks
+                            that are read again always use full paranoia
+        @type  paranoia:    str
         """
         task.MultiSeparateTask.__init__(self)
 
@@ -455,71 +887,177 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
 
         if taglist:
             logger.debug('read and verify with taglist %r', taglist)
-        # FIXME: choose a dir on the same disk/dir as the final path
-        fd, tmppath = tempfile.mkstemp(suffix='.whipper.wav')
-        tmppath = unicode(tmppath)
-        os.close(fd)
+        tmppath = None
+        if not stream:
+            tmppath = staging.create(
+                (stop - start + 1) * common.BYTES_PER_FRAME + 44)
         self._tmpwavpath = tmppath
 
         from whipper.common import checksum
 
-        self.tasks = []
-        self.tasks.append(
-            ReadTrackTask(tmppath, table, start, stop, overread,
-                          offset=offset, device=device, what=what))
-        self.tasks.append(checksum.CRC32Task(tmppath))
-        t = ReadTrackTask(tmppath, table, start, stop, overread,
-                          offset=offset, device=device, action="Verifying",
-                          what=what)
-        self.tasks.append(t)
-        self.tasks.append(checksum.CRC32Task(tmppath))
+        # checksum both reads while cd-paranoia outputs them, instead of
+        # reading a file again afterwards
+        # when storing the copy read, also checksum both reads in chunks so
+        # only the chunks on which they differ need to be read again
+        chunkFrames = tmppath and self.REREAD_FRAMES or None
+        self._testanalysis = checksum.TrackAnalysis(chunkFrames=chunkFrames)
+        self._copyanalysis = checksum.TrackAnalysis(trackNumber, trackCount,
+                                                    chunkFrames)
+        self._reread = None
+        self._reanalysis = None
+        self.rereads = []
+        self._table = table
+        self._start = start
+        self._stop = stop
+        self._overread = overread
+        self._offset = offset
+        self._device = device
+        self._what = what
+        self._trackNumber = trackNumber
+        self._trackCount = trackCount
+        self._accuraterip = accuraterip
+        self.paranoia = paranoia
+        self.encodeduration = 0.0
+        self._started = None
 
         # encode to the final path + '.part'
-        try:
-            tmpoutpath = path + u'.part'
-            open(tmpoutpath, 'wb').close()
-        except IOError as e:
-            if errno.ENAMETOOLONG != e.errno:
-                raise
-            path = common.truncate_filename(common.shrinkPath(path))
-            tmpoutpath = common.truncate_filename(path + u'.part')
-            open(tmpoutpath, 'wb').close()
+        path, tmpoutpath = partPath(path)
         self._tmppath = tmpoutpath
         self.path = path
+        self.wavpath = tmppath
+        self.partpath = tmpoutpath
+        self._encode = encode or stream
 
         from whipper.common import encode
 
-        self.tasks.append(encode.FlacEncodeTask(tmppath, tmpoutpath))
+        testaction, copyaction = "Reading", "Verifying"
+        if accuraterip:
+            # read the copy first; the test read may not be needed
+            testaction, copyaction = copyaction, testaction
+
+        # the test read is only checksummed, so never store it
+        self._testread = ReadTrackTask(None, table, start, stop, overread,
+                                       offset=offset, device=device,
+                                       action=testaction, what=what,
+                                       analysis=self._testanalysis,
+                                       paranoia=paranoia)
+        self._copyread = ReadTrackTask(tmppath, table, start, stop, overread,
+                                       offset=offset, device=device,
+                                       action=copyaction, what=what,
+                                       analysis=self._copyanalysis,
+                                       sink=stream and
+                                       encode.FlacStream(tmpoutpath) or None,
+                                       paranoia=paranoia)
+        self.tasks = [self._testread, self._copyread]
+        if accuraterip:
+            self.tasks.reverse()
+
+        if stream:
+            self.tasks.append(encode.TaggingTask(tmpoutpath, taglist))
+        elif self._encode:
+            # flac's --verify makes sure our encoding is accurate
+            self.tasks.append(encode.FlacEncodeTask(tmppath, tmpoutpath))
+
+            # TODO: Move tagging outside of cdparanoia
+            self.tasks.append(encode.TaggingTask(tmpoutpath, taglist))
+        self._encoding = [t for t in self.tasks
+                          if t not in (self._testread, self._copyread)]
 
-        # MerlijnWajer: XXX: We run the CRC32Task on the wav file, because it's
-        # in general stupid to run the CRC32 on the flac file since it already
-        # has --verify. We should just get rid of this CRC32 step.
-        # make sure our encoding is accurate
-        self.tasks.append(checksum.CRC32Task(tmppath))
-        self.tasks.append(encode.SoxPeakTask(tmppath))
+        self.checksum = None
 
-        # TODO: Move tagging outside of cdparanoia
-        self.tasks.append(encode.TaggingTask(tmpoutpath, taglist))
+    def started(self, t):
+        self._started = time.time()
+
+    def stopped(self, t):
+        if t in self._encoding:
+            self.encodeduration += time.time() - self._started
+
+        if t.exception:
+            pass
+        elif t is self._copyread and self._isAccurate():
+            logger.info('copy read matches AccurateRip, skipping test read')
+            self.tasks.remove(self._testread)
+            self._testread = None
+        elif t is self.tasks[1] and self._testread:
+            self._scheduleReread()
+
+        task.MultiSeparateTask.stopped(self, t)
+
+    def _isAccurate(self):
+        if not self._accuraterip:
+            return False
+        return any(['%08x' % arc in self._accuraterip
+                    for arc in (self._copyanalysis.arv1,
+                                self._copyanalysis.arv2)
+                    if arc is not None])
+
+    def _scheduleReread(self):
+        # after the copy read, repair the chunks that differ from the test
+        # read before encoding
+        test = self._testanalysis.chunks
+        copy = self._copyanalysis.chunks
+        if test is None or self._testanalysis.checksum == \
+                self._copyanalysis.checksum or len(test) != len(copy):
+            return
 
-        self.checksum = None
+        chunks = [i for i, (a, b) in enumerate(zip(test, copy)) if a != b]
+        if len(chunks) > len(copy) * self.REREAD_MAX:
+            logger.debug('%d of %d chunks differ, not re-reading',
+                         len(chunks), len(copy))
+            return
+
+        logger.info('test and copy read differ in %d of %d chunks, '
+                    're-reading them', len(chunks), len(copy))
+        from whipper.common import checksum
+        self._reread = RereadTask(self._tmpwavpath, self._table, self._start,
+                                  self._stop, self._overread, chunks,
+                                  self.REREAD_FRAMES, test,
+                                  offset=self._offset, device=self._device,
+                                  what=self._what)
+        # recalculate the copy checksums of the repaired file
+        self._reanalysis = checksum.TrackAnalysisTask(
+            self._tmpwavpath, self._trackNumber, self._trackCount)
+        self.tasks[self._task:self._task] = [self._reread, self._reanalysis]
 
     def stop(self):
+        self.errors = sum([r.errors or 0
+                           for r in (self._testread, self._copyread,
+                                     self._reread) if r])
+
         # FIXME: maybe this kind of try-wrapping to make sure
         # we chain up should be handled by a parent class function ?
         try:
             if not self.exception:
-                self.quality = max(self.tasks[0].quality,
-                                   self.tasks[2].quality)
-                self.peak = self.tasks[6].peak
+                reads = [r for r in (self._testread, self._copyread) if r]
+                self.quality = max([r.quality for r in reads])
+                copy = self._copyanalysis
+                if self._reanalysis:
+                    copy = self._reanalysis
+                    self.rereads = self._reread.ranges
+                self.peak = copy.peak
                 logger.debug('peak: %r', self.peak)
-                self.testspeed = self.tasks[0].speed
-                self.copyspeed = self.tasks[2].speed
-                self.testduration = self.tasks[0].duration
-                self.copyduration = self.tasks[2].duration
-
-                self.testchecksum = c1 = self.tasks[1].checksum
-                self.copychecksum = c2 = self.tasks[3].checksum
-                if c1 == c2:
+                self.arv1 = copy.arv1
+                self.arv2 = copy.arv2
+                self.testspeed = self.testduration = 0.0
+                if self._testread:
+                    self.testspeed = self._testread.speed
+                    self.testduration = self._testread.duration
+                self.copyspeed = self._copyread.speed
+                self.copyduration = self._copyread.duration
+                self.hotspots = self._copyread.hotspots
+
+                self.testchecksum = c1 = self._testanalysis.checksum
+                self.copychecksum = c2 = copy.checksum
+                if self._reanalysis:
+                    # every repaired chunk matches either the test read or
+                    # two new reads, so the repaired copy is verified; the
+                    # test checksum is kept as it was read
+                    logger.info('repaired copy read, %08x', c2)
+                    self.checksum = c2
+                elif not self._testread:
+                    logger.info('copy read is accurate, %08x', c2)
+                    self.checksum = c2
+                elif c1 == c2:
                     logger.info('checksums match, %08x', c1)
                     self.checksum = self.testchecksum
                 else:
@@ -529,14 +1067,13 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
                     self.exception = ChecksumException(
                         'read and verify failed: test checksum')
 
-                if self.tasks[5].checksum != self.checksum:
-                    self.exception = ChecksumException(
-                        'Encoding failed, checksum does not match')
-
-                # delete the unencoded file
-                os.unlink(self._tmpwavpath)
+                if self._tmpwavpath and (self._encode or self.exception):
+                    # delete the unencoded file
+                    staging.release(self._tmpwavpath)
 
-                if not self.exception:
+                if not self.exception and not self._encode:
+                    logger.debug('leaving %r to be encoded', self.wavpath)
+                elif not self.exception:
                     try:
                         logger.debug('moving to final path %r', self.path)
                         os.rename(self._tmppath, self.path)
@@ -544,27 +1081,145 @@ class ReadVerifyTrackTask(task.MultiSeparateTask):
                         logger.debug('exception while moving to final '
                                      'path %r: %s', self.path, e)
                         self.exception = e
-                else:
+                elif os.path.exists(self._tmppath):
                     os.unlink(self._tmppath)
             else:
                 logger.debug('stop: exception %r', self.exception)
+                if self._tmpwavpath:
+                    staging.release(self._tmpwavpath)
+                if os.path.exists(self._tmppath):
+                    os.unlink(self._tmppath)
         except Exception as e:
             print('WARNING: unhandled exception %r' % (e, ))
 
         task.MultiSeparateTask.stop(self)
 
 
+class ReadVerifyDiscTask(task.MultiSeparateTask):
+    """
+    I am a task that reads and verifies consecutive tracks in one
+    continuous test read and one continuous copy read, instead of two
+    cd-paranoia runs per track.
+
+    The tracks are left in a single .wav file, to be split when encoding.
+
+    @ivar wavpath:       the ripped .wav file; removed on failure
+    @ivar startFrame:    the first frame read
+    @ivar stopFrame:     the last frame read (inclusive)
+    @ivar testanalyses:  the analysis of each track in the test read, by
+                         track number
+    @ivar copyanalyses:  the analysis of each track in the copy read, by
+                         track number
+    @ivar testspeed:     the test speed, as a multiple of the duration
+    @ivar copyspeed:     the copy speed, as a multiple of the duration
+    @ivar testduration:  the test duration, in seconds
+    @ivar copyduration:  the copy duration, in seconds
+    @ivar hotspots:      the ranges of frames the copy read read more often
+                         than usual, as (first, last, reads) tuples
+    @ivar errors:        the number of SCSI errors cd-paranoia reported in
+                         the test and copy read
+    @ivar paranoia:      the paranoia level the test and copy read used
+    """
+
+    quality = None
+    testspeed = None
+    copyspeed = None
+    testduration = None
+    copyduration = None
+    hotspots = None
+    errors = None
+
+    def __init__(self, table, tracks, overread, offset=0, device=None,
+                 trackCount=None, paranoia='full'):
+        """
+        @param table:      table of contents of CD
+        @type  table:      L{table.Table}
+        @param tracks:     the tracks to read, in order and without gaps
+                           between them, as (number, start, stop) frames
+        @type  tracks:     list of tuple of (int, int, int)
+        @param offset:     read offset, in samples
+        @type  offset:     int
+        @param device:     the device to rip from
+        @type  device:     str
+        @param trackCount: the number of audio tracks on the disc
+        @type  trackCount: int
+        @param paranoia:   the paranoia level to read with; one of
+                           L{PARANOIA_LEVELS}
+        @type  paranoia:   str
+        """
+        task.MultiSeparateTask.__init__(self)
+        self.paranoia = paranoia
+
+        for (_, _, stop), (_, start, _) in zip(tracks, tracks[1:]):
+            assert start == stop + 1, "tracks %r are not consecutive" % (
+                tracks, )
+        self.startFrame = tracks[0][1]
+        self.stopFrame = tracks[-1][2]
+
+        self.wavpath = staging.create(
+            (self.stopFrame - self.startFrame + 1) * common.BYTES_PER_FRAME +
+            44, suffix='.whipper.disc.wav')
+
+        from whipper.common import checksum
+
+        numbers = [number for number, _, _ in tracks]
+        lengths = [(stop - start + 1) * common.SAMPLES_PER_FRAME
+                   for _, start, stop in tracks]
+        self.testanalyses = dict([(n, checksum.TrackAnalysis())
+                                  for n in numbers])
+        self.copyanalyses = dict([(n, checksum.TrackAnalysis(n, trackCount))
+                                  for n in numbers])
+
+        what = 'tracks %d to %d' % (numbers[0], numbers[-1])
+        # the test read is only checksummed, so never store it
+        self.tasks = [
+            ReadTrackTask(None, table, self.startFrame, self.stopFrame,
+                          overread, offset=offset, device=device, what=what,
+                          analysis=checksum.SplitAnalysis(
+                              [self.testanalyses[n] for n in numbers],
+                              lengths), paranoia=paranoia),
+            ReadTrackTask(self.wavpath, table, self.startFrame, self.stopFrame,
+                          overread, offset=offset, device=device,
+                          action="Verifying", what=what,
+                          analysis=checksum.SplitAnalysis(
+                              [self.copyanalyses[n] for n in numbers],
+                              lengths), paranoia=paranoia),
+        ]
+
+    def stop(self):
+        self.errors = sum([t.errors or 0 for t in self.tasks])
+        if not self.exception:
+            self.quality = max(self.tasks[0].quality, self.tasks[1].quality)
+            self.testspeed = self.tasks[0].speed
+            self.copyspeed = self.tasks[1].speed
+            self.testduration = self.tasks[0].duration
+            self.copyduration = self.tasks[1].duration
+            self.hotspots = self.tasks[1].hotspots
+        else:
+            logger.debug('stop: exception %r', self.exception)
+            staging.release(self.wavpath)
+
+        task.MultiSeparateTask.stop(self)
+
+
 _VERSION_RE = re.compile(
     "^cdparanoia (?P<version>.+) release (?P<release>.+)")
 
 
-def getCdParanoiaVersion():
-    getter = common.VersionGetter('cd-paranoia',
-                                  ["cd-paranoia", "-V"],
-                                  _VERSION_RE,
-                                  "%(version)s %(release)s")
+_version = None
+
 
-    return getter.get()
+def getCdParanoiaVersion():
+    # cd-paranoia is only run once per process to get the version
+    global _version
+    if _version is None:
+        getter = common.VersionGetter('cd-paranoia',
+                                      ["cd-paranoia", "-V"],
+                                      _VERSION_RE,
+                                      "%(version)s %(release)s")
+        _version = getter.get()
+
+    return _version
 
 
 _OK_RE = re.compile(r'Drive tests OK with Paranoia.')
@@ -102,8 +102,16 @@ def ReadTableTask(device, toc_path=None):
     return read_toc(device, toc_path=toc_path)
 
 
+_version = None
+
+
 def getCDRDAOVersion():
     """
     stopgap morituri-insanity compatibility layer
+
+    cdrdao is only run once per process to get the version.
     """
-    return version()
+    global _version
+    if _version is None:
+        _version = version()
+    return _version
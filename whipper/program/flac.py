@@ -1,19 +1,52 @@
-from subprocess import check_call, CalledProcessError
+from subprocess import check_call, CalledProcessError, Popen, PIPE
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def encode(infile, outfile):
+def encode(infile, outfile, skip=0, until=None):
     """
     Encodes infile to outfile, with flac.
     Uses '-f' because whipper already creates the file.
+
+    @param skip:  first sample of infile to encode
+    @type  skip:  int
+    @param until: sample of infile to stop encoding at (exclusive); None to
+                  encode until the end
+    @type  until: int or None
     """
+    argv = ['flac', '--silent', '--verify', '-o', outfile, '-f']
+    if skip:
+        argv.append('--skip=%d' % skip)
+    if until is not None:
+        argv.append('--until=%d' % until)
     try:
         # TODO: Replace with Popen so that we can catch stderr and write it to
         # logging
-        check_call(['flac', '--silent', '--verify', '-o', outfile,
-                    '-f', infile])
+        check_call(argv + [infile])
     except CalledProcessError:
         logger.exception('flac failed')
         raise
+
+
+def encode_stream(outfile):
+    """
+    Encodes the .wav data written to the stdin of the returned process to
+    outfile, with flac.
+
+    @rtype: L{subprocess.Popen}
+    """
+    return Popen(['flac', '--silent', '--verify', '-o', outfile, '-f', '-'],
+                 stdin=PIPE)
+
+
+def decode(infile):
+    """
+    Decodes infile with flac, to raw little-endian signed 16 bit samples
+    on the stdout of the returned process.
+
+    @rtype: L{subprocess.Popen}
+    """
+    return Popen(['flac', '--silent', '--decode', '--stdout',
+                  '--force-raw-format', '--endian=little', '--sign=signed',
+                  infile], stdout=PIPE)
@@ -1,8 +1,18 @@
+import fcntl
 import os
 
 import logging
 logger = logging.getLogger(__name__)
 
+# from linux/cdrom.h
+CDROM_DRIVE_STATUS = 0x5326
+CDSL_CURRENT = 0x7fffffff
+CDS_NO_INFO = 0
+CDS_NO_DISC = 1
+CDS_TRAY_OPEN = 2
+CDS_DRIVE_NOT_READY = 3
+CDS_DISC_OK = 4
+
 
 def eject_device(device):
     """
@@ -33,3 +43,23 @@ def unmount_device(device):
     if device in proc:
         print('Device %s is mounted, unmounting' % device)
         os.system('umount %s' % device)
+
+
+def get_drive_status(device):
+    """
+    Return the status of the given drive, as one of the CDS_ constants.
+
+    Asking does not wait for the drive, nor close its tray.
+    """
+    try:
+        fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError as e:
+        logger.debug('could not open %s: %r', device, e)
+        return CDS_NO_INFO
+    try:
+        return fcntl.ioctl(fd, CDROM_DRIVE_STATUS, CDSL_CURRENT)
+    except IOError as e:
+        logger.debug('could not get status of %s: %r', device, e)
+        return CDS_NO_INFO
+    finally:
+        os.close(fd)
@@ -193,6 +193,10 @@ class WhipperLogger(result.Logger):
             lines.append("    Extraction speed: %.1f X" % (
                 trackResult.copyspeed))
 
+        # Paranoia level the track was read with
+        if trackResult.paranoia:
+            lines.append("    Paranoia mode: %s" % trackResult.paranoia)
+
         # Extraction quality
         if trackResult.quality and trackResult.quality > 0.001:
             lines.append("    Extraction quality: %.2f %%" %
@@ -206,6 +210,16 @@ class WhipperLogger(result.Logger):
         if trackResult.copycrc is not None:
             lines.append("    Copy CRC: %08X" % trackResult.copycrc)
 
+        # Sectors read again to repair the copy read
+        if trackResult.rereads:
+            lines.append("    Re-read sectors: %s" % ", ".join(
+                ["%d-%d" % r for r in trackResult.rereads]))
+
+        # Sectors cdparanoia had to read more often than usual
+        if trackResult.hotspots:
+            lines.append("    Read hotspots: %s" % ", ".join(
+                ["%d-%d (%dx)" % h for h in trackResult.hotspots]))
+
         # AccurateRip track status
         ARDB_entry = 0
         ARDB_match = 0
@@ -236,6 +250,13 @@ class WhipperLogger(result.Logger):
         # Check if Test & Copy CRCs are equal
         if trackResult.testcrc == trackResult.copycrc:
             lines.append("    Status: Copy OK")
+        elif trackResult.rereads:
+            lines.append("    Status: Copy repaired (%d sectors re-read)" %
+                         sum([last - first + 1
+                              for first, last in trackResult.rereads]))
+        elif trackResult.testcrc is None and trackResult.copycrc is not None:
+            lines.append("    Status: Copy OK, test read skipped after "
+                         "AccurateRip match")
         else:
             self._errors = True
             lines.append("    Status: Error, CRC mismatch")
@@ -36,6 +36,13 @@ class TrackResult:
     # 4 byte CRCs for the test and copy reads
     testcrc = None
     copycrc = None
+    # ranges of frames read again to repair the copy read, inclusive
+    rereads = None
+    # paranoia level the track was read with; see cdparanoia.PARANOIA_LEVELS
+    paranoia = None
+    # ranges of frames read more often than usual, inclusive, with the most
+    # reads of a frame in each
+    hotspots = None
     AR = None
     classVersion = 3
 
@@ -2,8 +2,9 @@
 # vi:si:et:sw=4:sts=4:ts=4
 
 import sys
+import wave
 from StringIO import StringIO
-from os import chmod, makedirs
+from os import chmod, makedirs, urandom
 from os.path import dirname, exists, join
 from shutil import copy, rmtree
 from tempfile import mkdtemp
@@ -11,8 +12,8 @@ from unittest import TestCase
 
 from whipper.common import accurip
 from whipper.common.accurip import (
-    calculate_checksums, get_db_entry, print_report, verify_result,
-    _split_responses, EntryNotFound
+    calculate_checksums, get_confident_checksums, get_db_entry,
+    print_report, verify_result, _split_responses, EntryNotFound
 )
 from whipper.result.result import RipResult, TrackResult
 
@@ -83,8 +84,6 @@ class TestAccurateRipResponse(TestCase):
         self.assertEqual(responses[1].checksums[0], 'dc77f9ab')
         self.assertEqual(responses[1].checksums[1], 'dd97d2c3')
 
-# XXX: test arc.py
-
 
 class TestCalculateChecksums(TestCase):
     def test_returns_none_for_bad_files(self):
@@ -93,7 +92,24 @@ class TestCalculateChecksums(TestCase):
             {'v1': [None], 'v2': [None]}
         )
 
-    # TODO: test success when file exists
+    def test_preserves_order_with_workers(self):
+        tmpdir = mkdtemp(suffix='whipper_accurip_checksum_test')
+        self.addCleanup(rmtree, tmpdir)
+        paths = []
+        for i in range(4):
+            paths.append(join(tmpdir, '%d.wav' % i))
+            w = wave.open(paths[-1], 'wb')
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(44100)
+            w.writeframes(urandom(588 * 4 * 20))
+            w.close()
+        paths.append('/does/not/exist')
+
+        sequential = calculate_checksums(paths, workers=1)
+        self.assertEqual(calculate_checksums(paths, workers=3), sequential)
+        self.assertEqual(len(set(sequential['v1'])), 5)
+        self.assertEqual(sequential['v2'][4], None)
 
 
 class TestVerifyResult(TestCase):
@@ -189,6 +205,19 @@ class TestVerifyResult(TestCase):
             True
         )
 
+    def test_confident_checksums(self):
+        self.assertEqual(get_confident_checksums(self.responses, 1, 5),
+                         set(['284fc705', 'dc77f9ab']))
+        self.assertEqual(get_confident_checksums(self.responses, 2, 6),
+                         set(['9cc1f32e']))
+        self.assertEqual(get_confident_checksums(self.responses, 1, 21),
+                         set())
+        # HTOA and tracks not in the entry
+        self.assertEqual(get_confident_checksums(self.responses, 0, 1),
+                         set())
+        self.assertEqual(get_confident_checksums(self.responses, 3, 1),
+                         set())
+
     def test_stores_accuraterip_results_on_result(self):
         self.assertEqual(
             verify_result(self.result, self.responses, self.checksums),
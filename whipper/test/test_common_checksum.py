@@ -0,0 +1,332 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_checksum -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import binascii
+import os
+import struct
+import tempfile
+import wave
+
+from whipper.common import checksum, common
+from whipper.extern.task import task
+from whipper.program import flac
+
+from whipper.test import common as tcommon
+
+
+def _writeWave(path, samples):
+    w = wave.open(path, 'wb')
+    w.setnchannels(2)
+    w.setsampwidth(2)
+    w.setframerate(44100)
+    w.writeframes(samples)
+    w.close()
+
+
+class WaveTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        # 12 seconds of noise, so we need more than one chunk
+        self.samples = os.urandom(common.SAMPLES_PER_FRAME * 75 * 12 * 4)
+        fd, self.path = tempfile.mkstemp(suffix=u'.whipper.test.wav')
+        os.close(fd)
+        _writeWave(self.path, self.samples)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+
+class ReadWaveTestCase(WaveTestCase):
+
+    def testChunks(self):
+        chunks = list(checksum._read_wave(self.path))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(chunks[0]), checksum.CHUNK_SAMPLES * 4)
+        self.assertEqual(''.join(chunks), self.samples)
+
+    def testRange(self):
+        data = ''.join(checksum._read_wave(self.path, 100, 1000))
+        self.assertEqual(data, self.samples[400:4400])
+
+    def testMissingFrames(self):
+        self.assertRaises(common.MissingFrames, list,
+                          checksum._read_wave(self.path, 100, -1 + len(
+                              self.samples) / 4))
+
+
+class CRC32TestCase(WaveTestCase):
+
+    def _crc32(self, *args, **kwargs):
+        t = checksum.CRC32Task(kwargs.get('path', self.path), *args)
+        runner = task.SyncRunner(verbose=False)
+        runner.run(t)
+        return t.checksum
+
+    def testCRC32(self):
+        self.assertEqual(self._crc32(),
+                         binascii.crc32(self.samples) & 0xffffffff)
+
+    def testSampleRange(self):
+        self.assertEqual(self._crc32(588, 588 * 10),
+                         binascii.crc32(self.samples[588 * 4:588 * 11 * 4])
+                         & 0xffffffff)
+
+    def testFlac(self):
+        fd, path = tempfile.mkstemp(suffix=u'.whipper.test.flac')
+        os.close(fd)
+        flac.encode(self.path, path)
+        try:
+            self.assertEqual(self._crc32(0, -1, False, path=path),
+                             binascii.crc32(self.samples) & 0xffffffff)
+            self.assertEqual(self._crc32(588, 588 * 10, False, path=path),
+                             binascii.crc32(self.samples[588 * 4:588 * 11 * 4])
+                             & 0xffffffff)
+        finally:
+            os.unlink(path)
+
+
+class ReadFlacTestCase(WaveTestCase):
+
+    def setUp(self):
+        WaveTestCase.setUp(self)
+        fd, self.flac = tempfile.mkstemp(suffix=u'.whipper.test.flac')
+        os.close(fd)
+        flac.encode(self.path, self.flac)
+
+    def tearDown(self):
+        os.unlink(self.flac)
+        WaveTestCase.tearDown(self)
+
+    def testChunks(self):
+        chunks = list(checksum._read_flac(self.flac))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks), self.samples)
+
+    def testMissingFrames(self):
+        self.assertRaises(common.MissingFrames, list,
+                          checksum._read_flac(self.flac, 100, -1 + len(
+                              self.samples) / 4))
+
+
+def _accuraterip(data, trackNumber, trackCount):
+    # straight port of compute_v1_checksum/compute_v2_checksum from
+    # accuraterip-checksum (http://leo.bogert.de/accuraterip-checksum)
+    values = struct.unpack('<%dI' % (len(data) / 4), data)
+    checkFrom = 0
+    checkTo = len(values)
+    if trackNumber == 1:
+        checkFrom += 2940
+    if trackNumber == trackCount:
+        checkTo -= 2940
+    v1 = v2 = 0
+    for i, value in enumerate(values):
+        mulBy = i + 1
+        if checkFrom <= mulBy <= checkTo:
+            v1 = (v1 + mulBy * value) & 0xffffffff
+            product = mulBy * value
+            v2 = (v2 + (product & 0xffffffff) + (product >> 32)) & 0xffffffff
+    return v1, v2
+
+
+class AccurateRipChecksumTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        # 13 sectors of noise, just over the ten sectors skipped for
+        # a single track disc
+        self.data = os.urandom(13 * common.BYTES_PER_FRAME)
+
+    def _checksums(self, trackNumber, trackCount, chunk=None):
+        arc = checksum.AccurateRipChecksum(trackNumber, trackCount)
+        chunk = chunk or len(self.data)
+        for i in range(0, len(self.data), chunk):
+            arc.update(self.data[i:i + chunk])
+        return arc.finish()
+
+    def _testTracks(self):
+        for trackNumber, trackCount in [(1, 1), (1, 3), (2, 3), (3, 3)]:
+            self.assertEqual(self._checksums(trackNumber, trackCount),
+                             _accuraterip(self.data, trackNumber, trackCount))
+            # chunks that split samples and the skipped sectors
+            self.assertEqual(self._checksums(trackNumber, trackCount, 1001),
+                             _accuraterip(self.data, trackNumber, trackCount))
+
+    def testChecksums(self):
+        self._testTracks()
+
+    def testChecksumsWithoutNumpy(self):
+        numpy = checksum.numpy
+        checksum.numpy = None
+        try:
+            self._testTracks()
+        finally:
+            checksum.numpy = numpy
+
+    def testWave(self):
+        fd, path = tempfile.mkstemp(suffix=u'.whipper.test.wav')
+        os.close(fd)
+        _writeWave(path, self.data)
+        try:
+            self.assertEqual(checksum.accuraterip_checksums(path, 2, 3),
+                             _accuraterip(self.data, 2, 3))
+        finally:
+            os.unlink(path)
+
+    def testFlac(self):
+        fd, path = tempfile.mkstemp(suffix=u'.whipper.test.wav')
+        os.close(fd)
+        _writeWave(path, self.data)
+        fd, flacpath = tempfile.mkstemp(suffix=u'.whipper.test.flac')
+        os.close(fd)
+        try:
+            flac.encode(path, flacpath)
+            self.assertEqual(checksum.accuraterip_checksums(flacpath, 2, 3,
+                                                            is_wave=False),
+                             _accuraterip(self.data, 2, 3))
+        finally:
+            os.unlink(path)
+            os.unlink(flacpath)
+
+
+class AccurateRipOffsetChecksumsTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        # a track of 13 sectors with 50 samples of margin on each side
+        self.length = 13 * common.SAMPLES_PER_FRAME
+        self.data = os.urandom((self.length + 100) * 4)
+
+    def _track(self, offset):
+        start = (50 + offset) * 4
+        return self.data[start:start + self.length * 4]
+
+    def _testTracks(self):
+        offsets = [-50, -7, 0, 1, 48, 50]
+        for trackNumber, trackCount in [(1, 1), (2, 3), (3, 3)]:
+            arcs = checksum.AccurateRipOffsetChecksums(
+                self.data, 50, self.length, trackNumber, trackCount)
+            v1s = arcs.v1(offsets)
+            for offset in offsets:
+                expected = _accuraterip(self._track(offset),
+                                        trackNumber, trackCount)
+                self.assertEqual(v1s[offset], expected[0])
+                self.assertEqual(arcs.checksums(offset), expected)
+
+    def testChecksums(self):
+        self._testTracks()
+
+    def testChecksumsWithoutNumpy(self):
+        numpy = checksum.numpy
+        checksum.numpy = None
+        try:
+            self._testTracks()
+        finally:
+            checksum.numpy = numpy
+
+    def testOutOfRange(self):
+        arcs = checksum.AccurateRipOffsetChecksums(
+            self.data, 50, self.length, 2, 3)
+        self.assertEqual(arcs.v1([-51, 51]), {})
+
+
+class PeakLevelTestCase(tcommon.TestCase):
+
+    def testPeak(self):
+        data = struct.pack('<6h', 3, -2, 1000, -26215, 7, 26000)
+        peak = checksum.PeakLevel()
+        # split in the middle of a sample
+        peak.update(data[:7])
+        self.assertEqual(peak.peak, 1000)
+        peak.update(data[7:])
+        self.assertEqual(peak.peak, 26215)
+
+    def testMinimum(self):
+        peak = checksum.PeakLevel()
+        peak.update(struct.pack('<2h', -32768, 0))
+        self.assertEqual(peak.peak, 32768)
+
+    def testWithoutNumpy(self):
+        numpy = checksum.numpy
+        checksum.numpy = None
+        try:
+            self.testPeak()
+            self.testMinimum()
+        finally:
+            checksum.numpy = numpy
+
+
+class TrackAnalysisTestCase(WaveTestCase):
+
+    def testAnalysis(self):
+        t = checksum.TrackAnalysisTask(self.path, trackNumber=2,
+                                       trackCount=3)
+        runner = task.SyncRunner(verbose=False)
+        runner.run(t)
+
+        values = struct.unpack('<%dh' % (len(self.samples) / 2),
+                               self.samples)
+        self.assertEqual(t.checksum,
+                         binascii.crc32(self.samples) & 0xffffffff)
+        self.assertEqual((t.arv1, t.arv2),
+                         checksum.accuraterip_checksums(self.path, 2, 3))
+        self.assertEqual(t.peak, max(max(values), -min(values)))
+        self.assertEqual(t.samples, len(self.samples) / 4)
+
+    def testNoTrackNumber(self):
+        t = checksum.TrackAnalysisTask(self.path)
+        runner = task.SyncRunner(verbose=False)
+        runner.run(t)
+
+        self.assertEqual(t.arv1, None)
+        self.assertEqual(t.arv2, None)
+        self.assertEqual(t.samples, len(self.samples) / 4)
+
+    def testChunks(self):
+        t = checksum.TrackAnalysisTask(self.path, trackNumber=2,
+                                       trackCount=3)
+        runner = task.SyncRunner(verbose=False)
+        runner.run(t)
+
+        # as fed while the file is being written, not split on samples
+        a = checksum.TrackAnalysis(2, 3)
+        for i in range(0, len(self.samples), 100003):
+            a.update(self.samples[i:i + 100003])
+        a.finish()
+        self.assertEqual((a.checksum, a.arv1, a.arv2, a.peak, a.samples),
+                         (t.checksum, t.arv1, t.arv2, t.peak, t.samples))
+
+    def testChunkChecksums(self):
+        a = checksum.TrackAnalysis(chunkFrames=75)
+        for i in range(0, len(self.samples), 100003):
+            a.update(self.samples[i:i + 100003])
+        # a last, shorter chunk
+        a.update(self.samples[:common.BYTES_PER_FRAME])
+        a.finish()
+
+        data = self.samples + self.samples[:common.BYTES_PER_FRAME]
+        size = 75 * common.BYTES_PER_FRAME
+        self.assertEqual(a.chunks, [
+            binascii.crc32(data[i:i + size]) & 0xffffffff
+            for i in range(0, len(data), size)])
+        self.assertEqual(len(a.chunks), 13)
+        self.assertEqual(a.samples, len(data) / 4)
+        self.assertEqual(checksum.TrackAnalysis().chunks, None)
+
+
+class SplitAnalysisTestCase(WaveTestCase):
+
+    def testSplit(self):
+        lengths = [588 * 100, 588 * 500, len(self.samples) / 4 - 588 * 600]
+        analyses = [checksum.TrackAnalysis(n, 3) for n in (1, 2, 3)]
+        split = checksum.SplitAnalysis(analyses, lengths)
+        # chunks that don't line up with the tracks or samples
+        for i in range(0, len(self.samples), 300007):
+            split.update(self.samples[i:i + 300007])
+        split.update('trailing data')
+        split.finish()
+
+        start = 0
+        for n, length, a in zip((1, 2, 3), lengths, analyses):
+            data = self.samples[start * 4:(start + length) * 4]
+            self.assertEqual(a.checksum, binascii.crc32(data) & 0xffffffff)
+            self.assertEqual((a.arv1, a.arv2), _accuraterip(data, n, 3))
+            self.assertEqual(a.samples, length)
+            start += length
@@ -63,3 +63,17 @@ class GetRealPathTestCase(tcommon.TestCase):
 
         os.close(fd)
         os.unlink(path)
+
+
+class GetCPUCountTestCase(tcommon.TestCase):
+
+    def testUnknown(self):
+        def cpu_count():
+            raise NotImplementedError
+        original = common.multiprocessing.cpu_count
+        common.multiprocessing.cpu_count = cpu_count
+        try:
+            self.assertEqual(common.getCPUCount(), 1)
+        finally:
+            common.multiprocessing.cpu_count = original
+        self.assertTrue(common.getCPUCount() >= 1)
@@ -0,0 +1,91 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_encode -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import time
+import wave
+
+from whipper.common import checksum, encode
+
+from whipper.test import common as tcommon
+
+
+class EncodePoolTestCase(tcommon.TestCase):
+
+    def testFailure(self):
+        outdir = tempfile.mkdtemp(suffix=u'.whipper.test')
+        path = os.path.join(outdir, u'track.flac')
+        pool = encode.EncodePool(workers=2)
+        pool.submit(os.path.join(outdir, u'missing.wav'), path + u'.part',
+                    path, {})
+        failed = pool.join()
+        self.assertEqual([p for p, _ in failed], [path])
+        self.assertEqual(os.listdir(outdir), [])
+        os.rmdir(outdir)
+        # joining again does not wait for the stopped workers
+        self.assertEqual(pool.join(), failed)
+
+    def testSharedSlots(self):
+        slots = multiprocessing.BoundedSemaphore(1)
+        encode.limitEncoders(slots)
+        try:
+            # a failing encode gives its slot back
+            self.testFailure()
+            self.assertTrue(slots.acquire(False))
+            slots.release()
+
+            # and waits for one
+            slots.acquire()
+            pool = encode.EncodePool(workers=1)
+            pool.submit(u'/nonexistent.wav', u'/nonexistent.flac.part',
+                        u'/nonexistent.flac', {})
+            time.sleep(0.1)
+            self.assertEqual(pool._failed, [])
+            slots.release()
+            self.assertEqual(len(pool.join()), 1)
+        finally:
+            encode.limitEncoders(None)
+
+
+class FlacStreamTestCase(tcommon.TestCase):
+
+    def testStream(self):
+        fd, wavpath = tempfile.mkstemp(suffix=u'.whipper.test.wav')
+        os.close(fd)
+        fd, path = tempfile.mkstemp(suffix=u'.whipper.test.flac')
+        os.close(fd)
+        samples = os.urandom(588 * 4 * 75)
+        w = wave.open(wavpath, 'wb')
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(44100)
+        w.writeframes(samples)
+        w.close()
+        try:
+            stream = encode.FlacStream(path)
+            data = open(wavpath, 'rb').read()
+            for i in range(0, len(data), 10000):
+                stream.write(data[i:i + 10000])
+            stream.close()
+            self.assertEqual(''.join(checksum._read_flac(path)), samples)
+        finally:
+            os.unlink(wavpath)
+            os.unlink(path)
+
+    def testSharedSlots(self):
+        slots = multiprocessing.BoundedSemaphore(1)
+        encode.limitEncoders(slots)
+        try:
+            # flac holds the slot while it encodes
+            stream = encode.FlacStream(u'/nonexistent/track.flac')
+            stream.write('RIFF')
+            self.assertFalse(slots.acquire(False))
+            # and gives it back when it fails
+            self.assertRaises(subprocess.CalledProcessError, stream.close)
+            self.assertTrue(slots.acquire(False))
+            slots.release()
+        finally:
+            encode.limitEncoders(None)
@@ -0,0 +1,89 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_metrics -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import json
+import os
+import shutil
+import tempfile
+
+from whipper.common import metrics
+from whipper.result import result
+
+from whipper.test import common as tcommon
+
+
+class MetricsTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(suffix=u'.whipper.test')
+        self.result = result.RipResult()
+        self.result.vendor = 'HL-DT-ST'
+        self.result.model = 'DVDRAM "GH24NSD1"'
+        for number in (1, 2):
+            t = result.TrackResult()
+            t.number = number
+            t.filename = os.path.join(self.directory, u'%02d.flac' % number)
+            with open(t.filename, 'w') as f:
+                f.write('x' * 100 * number)
+            t.paranoia = 'full'
+            self.result.tracks.append(t)
+
+        self.metrics = metrics.Metrics()
+        with self.metrics.phase('toc'):
+            pass
+        self.metrics.addPhase('toc', 1.0)
+        self.metrics.addTrack(1, tries=2, scsi_errors=3,
+                              read_test_seconds=4.0, read_copy_seconds=5.0,
+                              bytes_read=2352)
+        self.metrics.addTrack(1, scsi_errors=1, encode_seconds=0.5)
+        self.metrics.addTrack(2, tries=1, read_copy_seconds=2.0)
+        self.metrics.addTotal(scsi_errors=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testCollect(self):
+        m = self.metrics.collect(self.result, '/dev/sr0')
+        self.assertTrue(m['phases']['toc'] >= 1.0)
+        self.assertEqual(m['phases']['read_test'], 4.0)
+        self.assertEqual(m['phases']['read_copy'], 7.0)
+        self.assertEqual(m['phases']['encode'], 0.5)
+
+        first, second = m['tracks']
+        self.assertEqual((first['tries'], first['retries'],
+                          first['scsi_errors'], first['bytes_written']),
+                         (2, 1, 4, 100))
+        self.assertEqual((second['retries'], second['scsi_errors'],
+                          second['bytes_written']), (0, 0, 200))
+        self.assertEqual(m['totals'], {
+            'tries': 3,
+            'retries': 1,
+            'scsi_errors': 14,
+            'bytes_read': 2352,
+            'bytes_written': 300,
+        })
+
+    def testJSON(self):
+        path = os.path.join(self.directory, 'metrics.json')
+        self.metrics.writeJSON(path, self.result, '/dev/sr0')
+        with open(path) as f:
+            m = json.load(f)
+        self.assertEqual(m['device'], '/dev/sr0')
+        self.assertEqual(len(m['tracks']), 2)
+
+    def testPrometheus(self):
+        path = os.path.join(self.directory, 'whipper.prom')
+        self.metrics.writePrometheus(path, self.result, '/dev/sr0')
+        with open(path) as f:
+            lines = f.read().splitlines()
+
+        labels = 'device="/dev/sr0",drive="HL-DT-ST DVDRAM \\"GH24NSD1\\""'
+        self.assertIn('whipper_rip_scsi_errors{%s} 14' % labels, lines)
+        self.assertIn('whipper_track_read_seconds{%s,read="copy",track="1"} '
+                      '5.0' % labels, lines)
+        self.assertIn('whipper_track_written_bytes{%s,track="2"} 200' %
+                      labels, lines)
+        self.assertIn('# TYPE whipper_rip_phase_seconds gauge', lines)
+        # the temporary file was moved into place
+        self.assertEqual(os.listdir(self.directory).count('whipper.prom'), 1)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
@@ -1,11 +1,16 @@
 # -*- Mode: Python; test-case-name: whipper.test.test_common_program -*-
 # vi:si:et:sw=4:sts=4:ts=4
 
-
+import binascii
+import os
+import tempfile
 import unittest
+import wave
 
 from whipper.common import program, mbngs, config
 from whipper.command.cd import DEFAULT_DISC_TEMPLATE
+from whipper.extern.task import task
+from whipper.result import result
 
 
 class PathTestCase(unittest.TestCase):
@@ -40,3 +45,39 @@ class PathTestCase(unittest.TestCase):
         path = prog.getPath(u'/tmp', u'%A/%d', 'mbdiscid', md, 0)
         self.assertEqual(path,
                          u'/tmp/Jeff Buckley/Grace')
+
+
+class VerifyTrackTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.samples = os.urandom(588 * 4 * 10)
+        fd, self.path = tempfile.mkstemp(suffix=u'.whipper.test.wav')
+        os.close(fd)
+        w = wave.open(self.path, 'wb')
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(44100)
+        w.writeframes(self.samples)
+        w.close()
+
+        self.trackResult = result.TrackResult()
+        self.trackResult.filename = self.path
+        self.trackResult.copycrc = binascii.crc32(self.samples) & 0xffffffff
+        # the test read disagreed with the copy read
+        self.trackResult.testcrc = self.trackResult.copycrc ^ 1
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _verify(self):
+        prog = program.Program(config.Config())
+        return prog.verifyTrack(task.SyncRunner(verbose=False),
+                                self.trackResult)
+
+    def testMismatch(self):
+        self.trackResult.rereads = []
+        self.assertFalse(self._verify())
+
+    def testRepaired(self):
+        self.trackResult.rereads = [(100, 174)]
+        self.assertTrue(self._verify())
@@ -0,0 +1,73 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_common_staging -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import shutil
+import tempfile
+import threading
+
+from whipper.common import staging
+
+from whipper.test import common as tcommon
+
+
+class StagingTestCase(tcommon.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(suffix=u'.whipper.test')
+        self.staging = staging.Staging(self.directory, 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _staged(self, path):
+        return os.path.dirname(path) == self.directory
+
+    def testBudget(self):
+        first = self.staging.create(60)
+        self.assertTrue(self._staged(first))
+        # does not fit, and nothing will make room
+        second = self.staging.create(60)
+        self.assertFalse(self._staged(second))
+        self.staging.release(second)
+        self.assertFalse(os.path.exists(second))
+
+        self.staging.release(first)
+        self.assertFalse(os.path.exists(first))
+        third = self.staging.create(100)
+        self.assertTrue(self._staged(third))
+        self.staging.release(third)
+
+    def testWaitsForHandedOff(self):
+        first = self.staging.create(60)
+        self.staging.handOff(first)
+        timer = threading.Timer(0.1, self.staging.release, (first, ))
+        timer.start()
+        second = self.staging.create(60)
+        timer.join()
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(self._staged(second))
+        self.staging.release(second)
+
+    def testNoBudget(self):
+        s = staging.Staging(self.directory)
+        paths = [s.create(2 ** 40) for _ in range(3)]
+        self.assertTrue(all([self._staged(p) for p in paths]))
+        for p in paths:
+            s.release(p)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def testBudgetWithoutDirectory(self):
+        s = staging.Staging(budget=100)
+        first = s.create(60)
+        s.handOff(first)
+        timer = threading.Timer(0.1, s.release, (first, ))
+        timer.start()
+        # waits for the first file even though both go to the default
+        # temporary directory
+        second = s.create(60)
+        self.assertFalse(os.path.exists(first))
+        timer.join()
+        self.assertEqual(s._used, 60)
+        s.release(second)
+        self.assertEqual(s._used, 0)
@@ -0,0 +1,183 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_extern_task -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import logging
+import time
+
+from whipper.common import task as ctask
+from whipper.extern.task import task
+
+from whipper.test import common
+
+
+class SleepTask(ctask.PopenTask):
+
+    def __init__(self, seconds, status=0):
+        self.command = ['sh', '-c', 'sleep %s; exit %d' % (seconds, status)]
+
+    def failed(self):
+        self.setException(Exception('exit code %d' %
+                                    self._popen.returncode))
+
+
+class OutputTask(ctask.PopenTask):
+
+    def __init__(self, script):
+        self.command = ['sh', '-c', script]
+        self.output = {'stdout': '', 'stderr': ''}
+        self.dones = 0
+
+    def readbytesout(self, bytes):
+        self.output['stdout'] += bytes
+
+    def readbyteserr(self, bytes):
+        self.output['stderr'] += bytes
+
+    def done(self):
+        self.dones += 1
+
+
+class FailingOutputTask(OutputTask):
+
+    def readbytesout(self, bytes):
+        raise ValueError(bytes)
+
+
+class PopenTestCase(common.TestCase):
+
+    def setUp(self):
+        self.runner = task.SyncRunner(verbose=False)
+        self.stops = 0
+
+    def _runTask(self, t):
+        t.addListener(self)
+        self.runner.run(t)
+
+    # ITaskListener methods
+    def started(self, t):
+        pass
+
+    def stopped(self, t):
+        self.stops += 1
+
+    def progressed(self, t, value):
+        pass
+
+    def described(self, t, description):
+        pass
+
+    def testStdoutClosedFirst(self):
+        t = OutputTask('echo out; exec 1>&-; sleep 0.2; echo err >&2')
+        self._runTask(t)
+        self.assertEqual(t.output, {'stdout': 'out\n', 'stderr': 'err\n'})
+        self.assertEqual((t.dones, self.stops), (1, 1))
+
+    def testStderrClosedFirst(self):
+        t = OutputTask('echo err >&2; exec 2>&-; sleep 0.2; echo out')
+        self._runTask(t)
+        self.assertEqual(t.output, {'stdout': 'out\n', 'stderr': 'err\n'})
+        self.assertEqual((t.dones, self.stops), (1, 1))
+
+    def testHandlerException(self):
+        # stderr is still open when reading stdout fails
+        t = FailingOutputTask('echo out; exec sleep 5')
+        start = time.time()
+        self.assertRaises(task.TaskException, self._runTask, t)
+        self.assertTrue(time.time() - start < 2.5)
+        self.assertTrue(isinstance(t.exception, ValueError))
+        # the command was stopped and reaped, and the task stopped once
+        self.assertEqual(t._popen.returncode, -15)
+        self.assertEqual((t.dones, self.stops), (0, 1))
+
+        # the runner can be used again
+        t = OutputTask('echo out')
+        self._runTask(t)
+        self.assertEqual(t.dones, 1)
+
+    def testWatchStopped(self):
+        t = OutputTask('echo out')
+        self._runTask(t)
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        task.logger.addHandler(handler)
+        try:
+            t.watch(0, self.fail)
+        finally:
+            task.logger.removeHandler(handler)
+        self.assertEqual([r.levelno for r in records], [logging.ERROR])
+        self.assertTrue('already stopped' in records[0].getMessage())
+
+
+class DescribingTask(OutputTask):
+
+    def readbytesout(self, bytes):
+        self.setDescription(bytes.strip())
+
+
+class MultiParallelTestCase(common.TestCase):
+
+    def setUp(self):
+        self.runner = task.SyncRunner(verbose=False)
+        self.order = []
+
+    def _task(self, seconds, status=0):
+        t = SleepTask(seconds, status)
+        t.addListener(self)
+        return t
+
+    # ITaskListener methods
+    def started(self, t):
+        self.order.append(('start', t))
+
+    def stopped(self, t):
+        self.order.append(('stop', t))
+
+    def progressed(self, t, value):
+        pass
+
+    def described(self, t, description):
+        pass
+
+    def testConcurrent(self):
+        m = task.MultiParallelTask(workers=2)
+        a, b, c = self._task(0.5), self._task(0.5), self._task(0)
+        m.addTask(a)
+        m.addTask(b)
+        m.addTask(c)
+        start = time.time()
+        self.runner.run(m)
+        # a and b ran at once, c once one of them was done
+        self.assertTrue(time.time() - start < 1.5)
+        self.assertEqual(self.order[:2], [('start', a), ('start', b)])
+        self.assertTrue(self.order.index(('start', c)) > 2)
+        self.assertEqual(m.progress, 1.0)
+
+    def testDescribed(self):
+        m = task.MultiParallelTask(workers=2)
+        m.addTask(DescribingTask('echo Described'))
+        self.runner.run(m)
+        self.assertEqual(m.description, 'Described (1 of 1) ...')
+
+    def testWorkers(self):
+        m = task.MultiParallelTask(workers=1)
+        a, b = self._task(0), self._task(0)
+        m.addTask(a)
+        m.addTask(b)
+        self.runner.run(m)
+        self.assertEqual(self.order, [('start', a), ('stop', a),
+                                      ('start', b), ('stop', b)])
+
+    def testFailure(self):
+        m = task.MultiParallelTask(workers=2)
+        a, b = self._task(0, 1), self._task(0.5)
+        c = self._task(0)
+        m.addTask(a)
+        m.addTask(b)
+        m.addTask(c)
+        self.assertRaises(task.TaskException, self.runner.run, m)
+        # b was left to finish, but nothing started after the failure
+        self.assertIn(('stop', b), self.order)
+        self.assertNotIn(('start', c), self.order)
+        self.assertEqual(self.order[-1], ('stop', b))
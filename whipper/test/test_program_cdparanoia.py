@@ -1,9 +1,16 @@
 # -*- Mode: Python; test-case-name: whipper.test.test_program_cdparanoia -*-
 # vi:si:et:sw=4:sts=4:ts=4
 
+import binascii
 import os
+import shutil
+import stat
+import tempfile
+import time
 
+from whipper.common import common as wcommon
 from whipper.extern.task import task
+from whipper.image import toc
 
 from whipper.program import cdparanoia
 
@@ -27,6 +34,15 @@ class ParseTestCase(common.TestCase):
         q = '%.01f %%' % (self._parser.getTrackQuality() * 100.0, )
         self.assertEqual(q, '99.6 %')
 
+    def testReadCounts(self):
+        for line in self._handle.readlines():
+            self._parser.parse(line)
+
+        counts = self._parser.getReadCounts()
+        self.assertEqual(len(counts), 47719 - 45990 + 1)
+        self.assertEqual(sum(counts), self._parser.reads)
+        self.assertEqual(self._parser.getHotspots(), [(47175, 47188, 4)])
+
 
 class Parse1FrameTestCase(common.TestCase):
 
@@ -61,6 +77,24 @@ class ErrorTestCase(common.TestCase):
 
         q = '%.01f %%' % (self._parser.getTrackQuality() * 100.0, )
         self.assertEqual(q, '79.6 %')
+        # the frames around the scsi errors were read over and over
+        self.assertEqual(self._parser.getHotspots(), [(3, 1196, 23)])
+        self.assertEqual(self._parser.getHotspots(24), [])
+
+    def testFeed(self):
+        # output as it comes in, split anywhere
+        parser = cdparanoia.ProgressParser(start=0, stop=10800)
+        data = self._handle.read()
+        for i in range(0, len(data), 1001):
+            parser.feed(data[i:i + 1001])
+
+        self._handle.seek(0)
+        self.testParse()
+        for attr in ('reads', 'read', 'wrote', 'errors'):
+            self.assertEqual(getattr(parser, attr),
+                             getattr(self._parser, attr))
+        self.assertEqual(parser.getReadCounts(),
+                         self._parser.getReadCounts())
 
 
 class VersionTestCase(common.TestCase):
@@ -89,3 +123,200 @@ class CacheTestCase(common.TestCase):
         t = AnalyzeFileTask(path)
         self.runner.run(t)
         self.assertTrue(t.defeatsCache)
+
+
+class AdaptiveParanoiaTestCase(common.TestCase):
+
+    def testEscalate(self):
+        self.assertEqual([cdparanoia.adaptiveParanoia(i) for i in range(5)],
+                         ['none', 'overlap', 'full', 'full', 'full'])
+
+
+class FailingAnalysis:
+
+    def update(self, data):
+        raise ValueError('cannot analyze')
+
+    def finish(self):
+        pass
+
+
+class ReadTrackTestCase(common.TestCase):
+    # reads ten frames with a cd-paranoia that writes them with the given
+    # script
+
+    # the whole read, then the frames checked again, in words
+    _PROGRESS = 'echo "##: 0 [read] @ %d" >&2; echo "##: 0 [read] @ 0" >&2' % (
+        10 * wcommon.WORDS_PER_FRAME)
+    _AUDIO = 'head -c %d /dev/zero' % (10 * wcommon.BYTES_PER_FRAME + 44)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(suffix=u'.whipper.test')
+        self._path = os.environ['PATH']
+        os.environ['PATH'] = self.directory + os.pathsep + self._path
+
+        t = toc.TocFile(os.path.join(os.path.dirname(__file__),
+                                     u'bloc.toc'))
+        t.parse()
+        self.table = t.table
+        self.runner = task.SyncRunner(verbose=False)
+        self.stops = 0
+
+    def tearDown(self):
+        os.environ['PATH'] = self._path
+        shutil.rmtree(self.directory)
+
+    def _script(self, script):
+        path = os.path.join(self.directory, 'cd-paranoia')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n%s\n' % script)
+        os.chmod(path, stat.S_IRWXU)
+
+    def _read(self, script, analysis=None):
+        self._script(script)
+        t = cdparanoia.ReadTrackTask(None, self.table, 0, 9, False,
+                                     analysis=analysis)
+        t.addListener(self)
+        self.runner.run(t)
+        return t
+
+    # ITaskListener methods
+    def started(self, t):
+        pass
+
+    def stopped(self, t):
+        self.stops += 1
+
+    def progressed(self, t, value):
+        pass
+
+    def described(self, t, description):
+        pass
+
+    def testStdoutClosedFirst(self):
+        t = self._read('%s; exec 1>&-; sleep 0.2; %s' % (
+            self._AUDIO, self._PROGRESS))
+        self.assertEqual(t.quality, 1.0)
+        self.assertEqual(t._streamed, 10 * wcommon.BYTES_PER_FRAME + 44)
+        self.assertEqual(self.stops, 1)
+
+    def testStderrClosedFirst(self):
+        t = self._read('%s; exec 2>&-; sleep 0.2; %s' % (
+            self._PROGRESS, self._AUDIO))
+        self.assertEqual(t.quality, 1.0)
+        self.assertEqual(t._streamed, 10 * wcommon.BYTES_PER_FRAME + 44)
+        self.assertEqual(self.stops, 1)
+
+    def testHandlerException(self):
+        # stderr is still open when analyzing the audio fails
+        start = time.time()
+        e = self.assertRaises(task.TaskException, self._read,
+                              '%s; exec sleep 5' % self._AUDIO,
+                              analysis=FailingAnalysis())
+        self.assertTrue(isinstance(e.exception, ValueError))
+        self.assertTrue(time.time() - start < 2.5)
+        self.assertEqual(self.stops, 1)
+
+        # the runner can be used again
+        t = self._read('%s; %s' % (self._AUDIO, self._PROGRESS))
+        self.assertEqual(t.quality, 1.0)
+
+    def testRereadErrors(self):
+        # every new read reports two SCSI errors
+        self._script('%s; echo "scsi_read error: sector=3 length=1 '
+                     'retry=1" >&2; echo "scsi_read error: sector=4 '
+                     'length=1 retry=1" >&2; %s' % (self._AUDIO,
+                                                    self._PROGRESS))
+        path = os.path.join(self.directory, u'track.wav')
+        audio = '\0' * 10 * wcommon.BYTES_PER_FRAME
+        with open(path, 'wb') as f:
+            f.write('\0' * 44 + audio)
+
+        t = cdparanoia.RereadTask(path, self.table, 0, 9, False, [0], 10,
+                                  [binascii.crc32(audio) & 0xffffffff])
+        self.runner.run(t)
+        self.assertEqual(t.ranges, [(0, 9)])
+        self.assertEqual(t.errors, 2 * cdparanoia.RereadTask.REREADS)
+
+    def _rereads(self, reads):
+        # every call of cd-paranoia writes the next of the given
+        # (first, last, data) reads, and logs its arguments
+        for i, (first, last, data) in enumerate(reads):
+            with open(os.path.join(self.directory, 'read%d' % i), 'wb') as f:
+                f.write('\0' * 44 + data)
+            with open(os.path.join(self.directory, 'progress%d' % i),
+                      'w') as f:
+                f.write('##: 0 [read] @ %d\n##: 0 [read] @ %d\n' % (
+                    (last + 1) * wcommon.WORDS_PER_FRAME,
+                    first * wcommon.WORDS_PER_FRAME))
+        self._script('cd "%s"; n=$(cat count 2>/dev/null || echo 0); '
+                     'echo $((n + 1)) > count; echo "$@" >> args; '
+                     'cat read$n; cat progress$n >&2' % self.directory)
+
+    def _wav(self, audio):
+        path = os.path.join(self.directory, u'track.wav')
+        with open(path, 'wb') as f:
+            f.write('\0' * 44 + audio)
+        return path
+
+    def _crc(self, audio):
+        return binascii.crc32(audio) & 0xffffffff
+
+    def testRereadRepairs(self):
+        # the copy read and the test read are both wrong, but the two new
+        # reads agree
+        good = 'a' * 10 * wcommon.BYTES_PER_FRAME
+        self._rereads([(0, 9, good), (0, 9, good)])
+        path = self._wav('b' * len(good))
+
+        t = cdparanoia.RereadTask(path, self.table, 0, 9, False, [0], 10,
+                                  [self._crc('c' * len(good))])
+        self.runner.run(t)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), '\0' * 44 + good)
+
+    def testRereadFirstAndLastChunk(self):
+        # 25 frames from the sixth frame of track 1 on, in chunks of 10
+        # frames; the first and the last, partial, chunk differ from the
+        # test read
+        start = self.table.getTrackStart(1) + 5
+        size = 10 * wcommon.BYTES_PER_FRAME
+        first, middle, last = 'a' * size, 'b' * size, 'c' * (size / 2)
+        self._rereads([(start, start + 9, first),
+                       (start, start + 9, 'x' * size),
+                       (start + 20, start + 24, 'y' * (size / 2)),
+                       (start + 20, start + 24, last)])
+        path = self._wav('d' * size + middle + 'e' * (size / 2))
+
+        t = cdparanoia.RereadTask(path, self.table, start, start + 24, False,
+                                  [0, 2], 10,
+                                  [self._crc(first), self._crc(middle),
+                                   self._crc(last)], offset=6)
+        self.runner.run(t)
+        self.assertEqual(t.ranges, [(start, start + 9),
+                                    (start + 20, start + 24)])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), '\0' * 44 + first + middle + last)
+
+        # only those chunks were read again, with the offset
+        with open(os.path.join(self.directory, 'args')) as f:
+            args = [line.split() for line in f.read().splitlines()]
+        self.assertEqual(len(args), 4)
+        for argv in args:
+            self.assertTrue('--sample-offset=6' in argv)
+        self.assertTrue(args[0][2].startswith('1[00:00:00.05]-'))
+        self.assertTrue(args[2][2].startswith('1[00:00:00.25]-'))
+
+    def testRereadDisagrees(self):
+        # no two reads agree, so the track has to be ripped again
+        size = 10 * wcommon.BYTES_PER_FRAME
+        self._rereads([(0, 9, 'a' * size), (0, 9, 'b' * size)])
+        path = self._wav('c' * size)
+
+        t = cdparanoia.RereadTask(path, self.table, 0, 9, False, [0], 10,
+                                  [self._crc('d' * size)])
+        e = self.assertRaises(task.TaskException, self.runner.run, t)
+        self.assertTrue(isinstance(e.exception,
+                                   cdparanoia.ChecksumException))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), '\0' * 44 + 'c' * size)
@@ -0,0 +1,23 @@
+# -*- Mode: Python; test-case-name: whipper.test.test_program_utils -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+import os
+import tempfile
+
+from whipper.program import utils
+from whipper.test import common
+
+
+class DriveStatusTestCase(common.TestCase):
+
+    def testNotADrive(self):
+        fd, path = tempfile.mkstemp(suffix=u'.whipper.test')
+        os.close(fd)
+        try:
+            self.assertEqual(utils.get_drive_status(path), utils.CDS_NO_INFO)
+        finally:
+            os.unlink(path)
+
+    def testMissing(self):
+        self.assertEqual(utils.get_drive_status('/nonexistent/sr0'),
+                         utils.CDS_NO_INFO)